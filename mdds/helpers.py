@@ -22,6 +22,12 @@ def one_hot_encoding(vocab, sent):
     return one_hot
 
 
+def one_hot_indices(vocab, sent):
+
+    # ids of the vocabulary shingles found in sent, the sparse form of one_hot_encoding
+    return {i for i, sh in enumerate(vocab) if sh in sent}
+
+
 def jaccard(v, u):
     return round(len(set(v) & set(u)) / len(set(v) | set(u)), 3)
     
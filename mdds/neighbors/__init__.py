@@ -1 +1,3 @@
-from .lsh import LSH, MinHash
+from .hashing import MinHash, HashFamily, UniversalMinHash, OnePermutationHash, BBitMinHash, WeightedMinHash, SimHash, PStableHash
+from .lsh import LSH
+from .forest import LSHForest
@@ -0,0 +1,190 @@
+from numpy import arange, argsort, lexsort, searchsorted, concatenate, unique, zeros, int64, log, floor
+from mdds.neighbors.sparse import SparseColumns
+from mdds.neighbors.hashing import UniversalMinHash
+from mdds.neighbors.lsh import LSH
+
+"""
+The LSHForest class indexes the documents with prefix trees of their signatures (Bawa et al., 2005), so that one index
+serves similarity queries at any threshold. LSH fixes the rows per band, and with them the S-curve and the similarity
+threshold it targets. The forest instead splits the nfuncs hash functions into trees of depth = nfuncs // trees functions,
+and stores every tree as the documents sorted lexicographically by their signature in it. The documents sharing a prefix of
+length m with a query form a contiguous range of that order, found by narrowing the range of the previous length with two
+binary searches, so a query can stop at any prefix length: long prefixes select few very similar documents, short ones
+many less similar documents.
+
+
+The LSHForest class has the following methods and attributes:
+
+    __init__(self, nfuncs, trees, hash_family, seed):
+        This method is the constructor of the class. It initializes the object with the number of hash functions (nfuncs),
+        the number of prefix trees (trees), the class used to sign the documents (hash_family) and the seed of its hash functions.
+
+    fit(self, data):
+        This method signs the documents of data (any input accepted by SparseColumns.from_data) and builds the sorted
+        signature arrays of every tree.
+
+    top_k(self, doc, k, candidates, metric):
+        This method returns the k stored documents most similar to a single new document. It descends every tree to the
+        longest prefix shared with the document, then shortens the prefix of all trees together until the ranges hold
+        enough candidates, and verifies them with the metric of the hash family.
+
+    query(self, doc, threshold, recall, metric):
+        This method returns the stored documents with similarity >= threshold to a single new document. It picks the
+        longest prefix length at which a document of similarity threshold collides with the query in at least one tree
+        with probability recall, collects the ranges of that length and verifies them.
+"""
+
+
+class LSHForest:
+    def __init__(self, nfuncs, trees, hash_family=UniversalMinHash, seed=None):
+        """
+        This method is the constructor of the class. It initializes the object with the number of hash functions (nfuncs),
+        the number of prefix trees (trees), the class used to sign the documents (hash_family) and the seed of its hash functions.
+        Every tree uses nfuncs // trees hash functions, which is the longest prefix a query can match.
+        """
+        # make sure signature can be split into trees
+        assert nfuncs % trees == 0
+
+        self.nfuncs = nfuncs
+        self.trees = trees
+
+        # prefix length of the trees
+        self.depth = nfuncs // trees
+
+        # signing method and the seed of its hash functions
+        self.hash_family = hash_family
+        self.seed = seed
+
+        # per tree: document ids in lexicographic order of their signatures, and the sorted signatures (depth, docs)
+        self.orders = []
+        self.prefixes = []
+
+
+    def fit(self, data):
+        """
+        This method signs the documents of data with the hash family and sorts them, in every tree, lexicographically by
+        the hash values of the tree. It costs one signature matrix and trees sorts of the documents.
+        """
+        self.hash_mehod = self.hash_family(data, nfuncs=self.nfuncs, seed=self.seed)
+
+        # each column represent the signature of each document
+        sign_matrix = self.hash_mehod._signature_matrix()
+
+        self.orders, self.prefixes = [], []
+        for t in range(self.trees):
+            rows = sign_matrix[t*self.depth:(t+1)*self.depth]
+
+            # lexsort sorts by the last key first
+            order = lexsort(rows[::-1])
+
+            self.orders.append(order)
+            self.prefixes.append(rows[:, order])
+
+        return self
+
+
+    def __len__(self):
+        return len(self.orders[0]) if self.orders else 0
+
+
+    def _ranges(self, signature):
+        """
+        This method descends every tree with a signature. It returns an array of shape (trees, depth + 1, 2) holding,
+        for every prefix length m, the range [lo, hi) of the sorted documents that share the first m hash values of the tree.
+        """
+        ranges = zeros((self.trees, self.depth + 1, 2), dtype=int64)
+
+        for t, prefix in enumerate(self.prefixes):
+            lo, hi = 0, len(self)
+            ranges[t, 0] = lo, hi
+
+            for m in range(self.depth):
+                # within the range, the documents are sorted by their hash value m
+                row = prefix[m, lo:hi]
+                lo, hi = lo + searchsorted(row, signature[t*self.depth + m], side='left'), lo + searchsorted(row, signature[t*self.depth + m], side='right')
+
+                ranges[t, m+1] = lo, hi
+
+        return ranges
+
+
+    def _collect(self, ranges, m):
+        """
+        This method returns the ids of the documents in the ranges of prefix length m of all the trees.
+        """
+        return unique(concatenate([order[lo:hi] for order, (lo, hi) in zip(self.orders, ranges[:, m])]))
+
+
+    def _similarities(self, docs, candidates, metric):
+        """
+        This method computes the similarity of a single new document to the candidates with SparseColumns.similarity,
+        on the candidate columns followed by the document.
+        """
+        metric = metric or getattr(self.hash_mehod, 'metric', 'jaccard')
+
+        columns = self.hash_mehod.columns.take(candidates).append(SparseColumns.from_data(docs, n_rows=self.hash_mehod.shape[0]))
+
+        return columns.similarity(arange(len(candidates)), zeros(len(candidates), dtype=int64) + len(candidates), metric=metric)
+
+
+    def top_k(self, doc, k=10, candidates=None, metric=None):
+        """
+        This method returns the k stored documents most similar to a single new document (a one-hot vector or a set of
+        shingle ids), as two NumPy arrays (ids, similarities) sorted by decreasing similarity. Every tree is descended to
+        the longest prefix it shares with the document, then the prefix length of all trees is shortened together, from the
+        longest one matched, until the ranges hold at least candidates documents (by default k times the number of trees).
+        The candidates are verified with the metric, by default the one of the hash family.
+        """
+        docs = LSH._as_documents(doc)
+
+        ranges = self._ranges(self.hash_mehod.signatures(docs)[:, 0])
+
+        if candidates is None:
+            candidates = k * self.trees
+
+        # longest prefix matched by a tree
+        matched = (ranges[:, :, 1] > ranges[:, :, 0]).sum(axis=1) - 1
+        m = int(matched.max())
+
+        found = self._collect(ranges, m)
+        while len(found) < candidates and m > 0:
+            m -= 1
+            found = self._collect(ranges, m)
+
+        sims = self._similarities(docs, found, metric)
+        best = argsort(-sims, kind='stable')[:k]
+
+        return found[best], sims[best]
+
+
+    def query(self, doc, threshold=.6, recall=.95, metric=None):
+        """
+        This method returns the stored documents with similarity >= threshold to a single new document, as a dictionary
+        of document id to similarity. A document of similarity s agrees with the query on a prefix of length m of a tree
+        with probability p^m, where p is the collision probability of the hash family at s (s itself for MinHash), so it is
+        found in at least one of the l trees with probability 1 - (1 - p^m)^l. The prefix length is the longest one for
+        which this probability reaches recall at s = threshold, which keeps the candidates
+        as few as the target recall allows. The candidates are verified with the metric, by default the one of the hash family.
+        """
+        docs = LSH._as_documents(doc)
+
+        ranges = self._ranges(self.hash_mehod.signatures(docs)[:, 0])
+
+        # probability that a document at the threshold agrees on one hash value
+        p = float(self.hash_mehod.collision_probability(threshold)) if hasattr(self.hash_mehod, 'collision_probability') else threshold
+
+        # longest prefix length with the target recall at the threshold
+        if p >= 1:
+            m = self.depth
+        elif p <= 0:
+            m = 0
+        else:
+            m = int(floor(log(1 - (1 - recall) ** (1 / self.trees)) / log(p)))
+            m = min(max(m, 0), self.depth)
+
+        found = self._collect(ranges, m)
+        sims = self._similarities(docs, found, metric)
+
+        keep = sims >= threshold
+
+        return dict(zip(found[keep].tolist(), sims[keep].tolist()))
@@ -0,0 +1,843 @@
+from numpy import zeros, empty, full, ones, arange, nonzero, searchsorted, minimum, concatenate, asarray, int64, argsort
+from numpy import dtype, repeat, diff, sqrt, float64, add, floor, flatnonzero, maximum, log, int8, inf, stack, where
+from numpy import uint8, uint32, uint64, packbits, unpackbits, linspace, arccos, cos, interp, clip, exp, pi, vectorize
+from math import erf
+from numpy.random import default_rng
+from random import shuffle, Random
+from mdds.neighbors.sparse import SparseColumns
+
+"""
+The hash families sign the documents stored as SparseColumns: every hash function maps a document to one value, and the
+signature matrix holds the values of all the functions (rows) for all the documents (columns). LSH bands the signature
+matrix and hashes every band to the buckets of its hash table, so any family below can be passed as its hash_family.
+
+
+The MinHash class generates the signature matrix of the input documents with random permutations of the rows.
+It has the following methods and attributes:
+
+    __init__(self, one_hot_matrix, nfuncs, seed): 
+       
+    _hash(self): 
+        
+    _signature_matrix(self):
+
+
+The UniversalMinHash class is a vectorized drop-in for MinHash. Instead of storing every hash function as a shuffled list
+of row indices, it draws nfuncs universal hash functions h(x) = (a*x + b) mod p and takes, for every column, the minimum
+of each function over the indices of its nonzero rows. All the functions are evaluated in one NumPy pass with
+numpy.minimum.reduceat, so signing costs O(nfuncs * nonzeros).
+
+
+The OnePermutationHash class signs with a single hash function: the nonzero rows of a document are hashed once, the
+hash range is split into nfuncs bins whose minima form the signature, and empty bins are filled by optimal densification.
+It approximates the Jaccard similarity like MinHash at the cost of one hash evaluation per nonzero.
+
+
+The BBitMinHash class keeps only the lowest bits of every UniversalMinHash value and stores the signature matrix packed
+into bytes, with the unbiased Jaccard estimator of b-bit MinHash. UniversalMinHash can also produce uint32 signatures.
+
+
+The WeightedMinHash class signs non-negative weighted documents (shingle counts, TF-IDF) with Improved Consistent Weighted
+Sampling, so that signatures agree with probability equal to the weighted Jaccard similarity, and band like any other.
+
+
+The SimHash and PStableHash classes are hash families for other metrics, sharing the HashFamily base with UniversalMinHash.
+SimHash signs documents with the sides of random hyperplanes (cosine similarity), PStableHash with segments of random
+Gaussian projections (euclidean distance). Both compute all their hash functions with one sparse matrix product.
+The metric attribute of a family names the similarity it approximates, and LSH verifies candidates with it by default.
+The collision_probability method of a family maps a similarity to the probability that two documents agree on one hash
+value, and its perturbations method gives the alternative hash values probed by multi-probe queries. Probes recover the
+most recall for SimHash, where the alternative of a bit is its flip. A MinHash value of a close document that comes from a
+row the query lacks is none of the alternatives of the query, so for the MinHash families probes recover only part of the
+recall that more bands would give.
+"""
+
+
+# Mersenne prime 2^31 - 1 of the universal hash functions (a*x + b) mod p of the MinHash families, it also marks the
+# signature of an empty column. Row ids are reduced mod p first, so that a*x stays below 2^62 whatever the id;
+# ids that differ by a multiple of p then share their hash values, like any other hash collision
+PRIME = (1 << 31) - 1
+
+
+def _universal_hash(a, b, rows):
+    """
+    Computes (a*x + b) mod p for the row ids x, with the coefficients a and b broadcast against them.
+    """
+    return (a * (rows % PRIME) + b) % PRIME
+
+
+class MinHash:
+    def __init__(self, one_hot_matrix, nfuncs, seed=None):
+        """
+        This method is the constructor of the class. It initializes the object with the input documents (a one-hot encoded
+        matrix, a sparse matrix or shingle-id sets), the number of hash functions (nfuncs), and the signature matrix (sign_matrix)
+        which is initially set to None. The permutations are drawn from the global random state, unless a seed is given.
+        """
+
+        # the documents, column by column
+        self.columns = SparseColumns.from_data(one_hot_matrix)
+
+        # store dimensionality
+        self.shape = self.columns.shape
+        
+        # vertical dimmensionality of signature M
+        self.nfuncs = nfuncs
+
+        # source of the permutations
+        self.shuffle = shuffle if seed is None else Random(seed).shuffle
+
+        # create hash functions
+        self.functions = self.build_functions(nfuncs)
+
+        # signatures
+        self.sign_matrix = None
+
+
+    def _hash(self):
+        """
+        This method creates a list of indices of the rows of the one-hot encoded matrix in a random order.
+        build_functions(self, nfuncs): This method builds nfuncs number of hash functions by calling the _hash() method.
+        """
+
+        # one_hot indices vector
+        hash_indices = list(range(1, self.shape[0]+1))
+
+        # shuffle 
+        self.shuffle(hash_indices)
+
+        return hash_indices
+
+
+    # basically, it returns a 2D list of indices permutations
+    def build_functions(self, nfuncs):
+        return [self._hash() for _ in range(nfuncs)]
+
+
+    # create hash method takes as input the documents
+    # and produces a compressed vector signature for each of them
+    def signatures(self, data):
+        """
+        This method creates the signature matrix of the documents in data (any input accepted by SparseColumns.from_data)
+        using the hash functions created by the build_functions() method, and returns it. The signature of a document is,
+        for every permutation, the smallest rank of its rows; empty documents keep 0. The permutations only rank the rows
+        of the vocabulary they were drawn for, so a shingle id past it raises a ValueError.
+        """
+        columns = SparseColumns.from_data(data, n_rows=self.shape[0])
+
+        if len(columns.indices) and int(columns.indices.max()) >= self.shape[0]:
+            raise ValueError(f"shingle id {int(columns.indices.max())} is out of the vocabulary of {self.shape[0]} rows MinHash was drawn for")
+
+        # rank of every row in every permutation, they fit in 32 bits
+        ranks = asarray(self.functions, dtype=uint32).reshape(self.nfuncs, self.shape[0])
+
+        sign_matrix = zeros(shape=(self.nfuncs, len(columns)), dtype=uint32)
+
+        nonempty = flatnonzero(diff(columns.indptr))
+        if len(nonempty):
+            sign_matrix[:, nonempty] = minimum.reduceat(ranks[:, columns.indices], columns.indptr[nonempty], axis=1)
+
+        return sign_matrix
+
+
+    def _signature_matrix(self):
+        """
+        This method creates the signature matrix of the input documents. It assigns the signature matrix
+        to the sign_matrix attribute of the class. The method returns the signature matrix.
+        """
+        self.sign_matrix = self.signatures(self.columns)
+
+        return self.sign_matrix
+
+
+class HashFamily:
+    """
+    Base class of the vectorized hash families. A family holds the documents it was built on (as SparseColumns in
+    columns, whatever the input), draws nfuncs hash functions from seed, and signs any input accepted by
+    SparseColumns.from_data into a signature matrix of shape (nfuncs, docs). Subclasses implement build_functions and
+    signatures, and name in metric the similarity their collision probability follows, which LSH uses for verification.
+    """
+
+    # similarity measure approximated by the family
+    metric = None
+
+    # whether the functions draw a value per row of the vocabulary, which then cannot grow
+    fixed_vocabulary = False
+
+    def __init__(self, one_hot_matrix, nfuncs, seed=None, chunk_size=1 << 22):
+        """
+        This method is the constructor of the class. It initializes the object with the input documents (a one-hot encoded matrix,
+        a sparse matrix or shingle-id sets), the number of hash functions (nfuncs), the seed of the hash functions and the number
+        of hash values (chunk_size) evaluated at once, which bounds the memory of signing.
+        """
+
+        # the documents, column by column, the input itself is not kept
+        self.columns = SparseColumns.from_data(one_hot_matrix)
+
+        # store dimensionality
+        self.shape = self.columns.shape
+
+        # vertical dimmensionality of signature M
+        self.nfuncs = nfuncs
+
+        self.seed = seed
+        self.chunk_size = chunk_size
+
+        # signatures
+        self.sign_matrix = None
+
+
+    def _chunks(self, columns):
+        """
+        Splits the columns into chunks of whole columns holding about chunk_size hash values (nfuncs per nonzero).
+        Yields the range of columns [c, stop), the range of their entries [lo, hi), and the offsets of the nonempty
+        columns within the entries, as expected by numpy ufunc reduceat.
+        """
+        starts = columns.indptr
+        per_chunk = max(1, self.chunk_size // self.nfuncs)
+
+        c = 0
+        while c < len(columns):
+            # take whole columns, as many as fit in the chunk
+            stop = max(c + 1, searchsorted(starts, starts[c] + per_chunk, side='right') - 1)
+            stop = min(stop, len(columns))
+
+            lo, hi = starts[c], starts[stop]
+
+            if hi > lo:
+                nonempty = starts[c:stop] < starts[c+1:stop+1]
+                yield c, stop, lo, hi, nonempty, starts[c:stop][nonempty] - lo
+
+            c = stop
+
+
+    def _check_vocabulary(self, columns):
+        """
+        Raises a ValueError if the family draws a value per row (fixed_vocabulary) and the columns hold a shingle id
+        past the vocabulary the functions were drawn for.
+        """
+        if self.fixed_vocabulary and len(columns.indices) and int(columns.indices.max()) >= self.shape[0]:
+            raise ValueError(f"shingle id {int(columns.indices.max())} is out of the vocabulary of {self.shape[0]} rows "
+                             f"{type(self).__name__} was drawn for; pass the size of the whole vocabulary up front")
+
+
+    def _project(self, data, matrix):
+        """
+        Computes the product matrix @ X of a dense (nfuncs, vocab) matrix with the documents X of data, in one
+        vectorized pass over the nonzeros of every chunk of columns.
+        """
+        columns = SparseColumns.from_data(data, n_rows=self.shape[0])
+        self._check_vocabulary(columns)
+
+        projections = zeros((len(matrix), len(columns)), dtype=float64)
+
+        for c, stop, lo, hi, nonempty, offsets in self._chunks(columns):
+            products = matrix[:, columns.indices[lo:hi]] * columns.values[lo:hi]
+            projections[:, c:stop][:, nonempty] = add.reduceat(products, offsets, axis=1)
+
+        return projections
+
+
+    def build_functions(self, nfuncs):
+        raise NotImplementedError
+
+
+    def signatures(self, data):
+        raise NotImplementedError
+
+
+    def perturbations(self, data):
+        """
+        Returns the alternative hash values of the documents in data that a close document is most likely to get instead,
+        as two arrays of shape (nfuncs, alternatives, docs): the values and their costs. A lower cost means a more likely
+        alternative, and costs add up over perturbed functions. Multi-probe LSH visits the buckets of the cheapest ones.
+        By default there are no alternatives, and multi-probe queries visit the buckets of the signature only.
+        """
+        n_docs = len(SparseColumns.from_data(data))
+
+        return empty((self.nfuncs, 0, n_docs), dtype=int64), empty((self.nfuncs, 0, n_docs))
+
+
+    def collision_probability(self, similarity):
+        """
+        Returns the probability that two documents with the given similarity (in the metric of the family) agree on
+        one hash value. It is the similarity itself for MinHash.
+        """
+        return similarity
+
+
+    def compact(self, sign_matrix):
+        """
+        Returns the form in which a signature matrix is stored in sign_matrix. It is the matrix itself, unless the family
+        packs its hash values (BBitMinHash). Stored matrices of several document sets concatenate along the columns.
+        """
+        return sign_matrix
+
+
+    def expand(self, stored):
+        """
+        Returns the signature matrix of a stored one, the inverse of compact.
+        """
+        return stored
+
+
+    def estimate(self, i, j):
+        """
+        Estimates the similarity of the stored document pairs (i[k], j[k]) from their signatures only, as the fraction of
+        hash values they agree on. For MinHash it is an unbiased estimate of their Jaccard similarity.
+        """
+        return (self.expand(self.sign_matrix[:, i]) == self.expand(self.sign_matrix[:, j])).mean(axis=0)
+
+
+    def _signature_matrix(self):
+        """
+        This method creates the signature matrix of the input one-hot encoded matrix, assigns its stored (compact) form
+        to the sign_matrix attribute of the class and returns the signature matrix.
+        """
+        sign_matrix = self.signatures(self.columns)
+
+        self.sign_matrix = self.compact(sign_matrix)
+
+        return sign_matrix
+
+
+    def __getstate__(self):
+        """
+        Pickles only the hash functions, so that worker processes receive the exact same functions without the documents,
+        which they read from shared memory.
+        """
+        state = self.__dict__.copy()
+
+        for name in ('columns', 'sign_matrix'):
+            state[name] = None
+
+        return state
+
+
+class UniversalMinHash(HashFamily):
+    """
+    Vectorized MinHash over universal hash functions h(x) = (a*x + b) mod p, where x is the index of a nonzero row.
+    It exposes the same attributes as MinHash (columns, shape, nfuncs, sign_matrix), so it can be used
+    as the hash_family of LSH. Besides dense one-hot matrices, it signs any input accepted by SparseColumns.from_data,
+    touching only the nonzeros. Two documents agree on a hash value with probability equal to their Jaccard similarity.
+    """
+
+    metric = 'jaccard'
+
+    prime = PRIME
+
+    def __init__(self, one_hot_matrix, nfuncs, seed=None, chunk_size=1 << 22, dtype=int64, alternatives=4):
+        """
+        Same as HashFamily, with the integer type of the signatures and the number of alternatives of every hash value
+        that multi-probe queries may try. The hash values are below 2^31, so uint32 signatures hold them exactly in half
+        the memory; use functools.partial(UniversalMinHash, dtype=numpy.uint32) as the hash_family of LSH.
+        """
+        super().__init__(one_hot_matrix, nfuncs, seed=seed, chunk_size=chunk_size)
+
+        # stored by name, so that it can be saved
+        self.dtype = zeros(0, dtype=dtype).dtype.name
+
+        self.alternatives = alternatives
+
+        # create hash functions
+        self.a, self.b = self.build_functions(nfuncs)
+
+
+    def build_functions(self, nfuncs):
+        """
+        Draws the coefficients a in [1, p) and b in [0, p) of nfuncs universal hash functions.
+        """
+        rng = default_rng(self.seed)
+
+        a = rng.integers(1, self.prime, size=nfuncs, dtype=int64)
+        b = rng.integers(0, self.prime, size=nfuncs, dtype=int64)
+
+        return a, b
+
+
+    def signatures(self, data):
+        """
+        Computes the signatures of the documents in data (any input accepted by SparseColumns.from_data). The nonzero row
+        indices are taken column by column, hashed by all the functions at once, and reduced to their per column minimum
+        with minimum.reduceat. Columns are processed in chunks holding about chunk_size hash values, and only the
+        signature matrix, of type dtype, spans all the documents. The minima of every chunk go through _reduce first.
+        """
+        columns = SparseColumns.from_data(data)
+
+        # empty columns keep the empty signature
+        sign_matrix = full((self.nfuncs, len(columns)), self._reduce(self.prime), dtype=self.dtype)
+
+        for c, stop, lo, hi, nonempty, offsets in self._chunks(columns):
+            hashes = _universal_hash(self.a[:, None], self.b[:, None], columns.indices[None, lo:hi])
+            sign_matrix[:, c:stop][:, nonempty] = self._reduce(minimum.reduceat(hashes, offsets, axis=1))
+
+        return sign_matrix
+
+
+    def _reduce(self, minima):
+        """
+        Returns the signature values of the minima, the minima themselves.
+        """
+        return minima
+
+
+    def perturbations(self, data):
+        """
+        The alternatives of every minimum are the next smallest hash values of the document, the second to the
+        (alternatives + 1)-th. A close document lacking the rows of the smallest values takes the next one it shares,
+        unless it holds a row of its own hashing below; the farther a value lies from the minimum, the more likely such a
+        row is, so the cost is the gap to the minimum relative to p. Values missing in short documents have infinite cost.
+        With a single alternative per function, a band of r functions has only 2^r - 1 perturbations, which caps the recall
+        that probes can add; deeper alternatives lift that cap.
+        """
+        columns = SparseColumns.from_data(data)
+
+        values = full((self.nfuncs, self.alternatives, len(columns)), self.prime, dtype=int64)
+        costs = full((self.nfuncs, self.alternatives, len(columns)), inf)
+
+        for c, stop, lo, hi, nonempty, offsets in self._chunks(columns):
+            hashes = _universal_hash(self.a[:, None], self.b[:, None], columns.indices[None, lo:hi])
+            lengths = diff(concatenate((offsets, [hi - lo])))
+
+            firsts = previous = minimum.reduceat(hashes, offsets, axis=1)
+
+            for k in range(self.alternatives):
+                # hide the last minimum of every column, then take the minimum again
+                hashes[hashes == repeat(previous, lengths, axis=1)] = self.prime
+                previous = minimum.reduceat(hashes, offsets, axis=1)
+
+                values[:, k, c:stop][:, nonempty] = previous
+                costs[:, k, c:stop][:, nonempty] = where(previous < self.prime, (previous - firsts) / self.prime, inf)
+
+        return values, costs
+
+
+class OnePermutationHash(HashFamily):
+    """
+    One permutation hashing with optimal densification (Li et al., 2012; Shrivastava, 2017). Instead of nfuncs hash
+    functions, every nonzero row is hashed once with h(x) = (a*x + b) mod p, the range of h is split into nfuncs bins of
+    equal width, and the signature of a document holds the minimum of every bin, so signing costs O(nonzeros) instead of
+    O(nfuncs * nonzeros). An empty bin j takes the value of the first nonempty bin among g(j, 0), g(j, 1), ..., where g is a
+    universal hash of (bin, attempt) that does not depend on the document; two documents then agree on a bin with
+    probability equal to their Jaccard similarity, as with MinHash, and the signatures band like any other.
+    """
+
+    metric = 'jaccard'
+
+    prime = PRIME
+
+    def __init__(self, one_hot_matrix, nfuncs, seed=None, chunk_size=1 << 22):
+        super().__init__(one_hot_matrix, nfuncs, seed=seed, chunk_size=chunk_size)
+
+        # create the permutation and the densification hash
+        self.a, self.b, self.c, self.d = self.build_functions(nfuncs)
+
+
+    def build_functions(self, nfuncs):
+        """
+        Draws the coefficients of the universal hash h that permutes the rows, and of the universal hash g of densification.
+        """
+        rng = default_rng(self.seed)
+
+        a, c = rng.integers(1, self.prime, size=2, dtype=int64)
+        b, d = rng.integers(0, self.prime, size=2, dtype=int64)
+
+        # python integers, so that they are saved as scalars (their products stay below 2^62, within int64)
+        return int(a), int(b), int(c), int(d)
+
+
+    def _bins(self, data, second=False):
+        """
+        Computes the densified minimum of every bin of the documents in data, as a matrix of shape (nfuncs, docs), and,
+        if second, the densified second smallest hash value of every bin (p if the bin holds a single row).
+        The entries of a chunk of columns are sorted by (column, hash value), which also sorts them by bin within a column
+        since bins are ranges of hash values, so the minimum of a bin is the first entry of its group. Empty columns keep
+        the empty signature.
+        """
+        columns = SparseColumns.from_data(data)
+
+        firsts = full((self.nfuncs, len(columns)), self.prime, dtype=int64)
+        seconds = full((self.nfuncs, len(columns)), self.prime, dtype=int64) if second else None
+
+        for c, stop, lo, hi, nonempty, offsets in self._chunks(columns):
+            cols = repeat(arange(stop - c), diff(columns.indptr[c:stop+1]))
+
+            # hash every nonzero once, and split the range of the hash in nfuncs bins
+            hashes = _universal_hash(self.a, self.b, columns.indices[lo:hi])
+            bins = hashes * self.nfuncs // self.prime
+
+            # the entries are grouped by column already, the hash values are below p
+            order = argsort(cols * self.prime + hashes)
+            cols, bins, hashes = cols[order], bins[order], hashes[order]
+
+            # first entry of every (column, bin) group
+            starts = ones(len(order), dtype=bool)
+            starts[1:] = (cols[1:] != cols[:-1]) | (bins[1:] != bins[:-1])
+
+            firsts[bins[starts], c + cols[starts]] = hashes[starts]
+
+            if second:
+                # the entry after the first one, when in the same group
+                follows = zeros(len(order), dtype=bool)
+                follows[1:] = starts[:-1] & ~starts[1:]
+
+                seconds[bins[follows], c + cols[follows]] = hashes[follows]
+
+        self._densify(firsts, seconds)
+
+        return firsts, seconds
+
+
+    def _densify(self, firsts, seconds=None):
+        """
+        Fills in place the empty bins of the documents with at least one nonempty bin. The empty bin j of a document takes
+        the values of the first nonempty bin g(j, t) of the document for t = 0, 1, ..., with g(j, t) = ((c*(j + nfuncs*t) + d)
+        mod p) mod nfuncs. All the empty bins of all the documents are resolved together, attempt after attempt.
+        """
+        empty_bins = firsts == self.prime
+
+        # documents without any nonzero stay empty
+        bins, cols = nonzero(empty_bins & ~empty_bins.all(axis=0))
+
+        attempt = 0
+        while len(bins):
+            sources = ((self.c * (bins + self.nfuncs * attempt) + self.d) % self.prime) % self.nfuncs
+
+            # the values are read from bins that were not empty, so filling in place is safe
+            found = ~empty_bins[sources, cols]
+            firsts[bins[found], cols[found]] = firsts[sources[found], cols[found]]
+            if seconds is not None:
+                seconds[bins[found], cols[found]] = seconds[sources[found], cols[found]]
+
+            bins, cols = bins[~found], cols[~found]
+            attempt += 1
+
+
+    def signatures(self, data):
+        """
+        Computes the densified one permutation signatures of the documents in data (any input accepted by
+        SparseColumns.from_data), with one hash evaluation per nonzero.
+        """
+        return self._bins(data)[0]
+
+
+    def perturbations(self, data):
+        """
+        The alternative of every bin minimum is the second smallest hash value of the bin (of the bin it was copied from,
+        for a densified bin), with the gap between the two relative to p as cost, like UniversalMinHash.
+        """
+        firsts, seconds = self._bins(data, second=True)
+
+        costs = where(seconds < self.prime, (seconds - firsts) / self.prime, inf)
+
+        return seconds[:, None], costs[:, None]
+
+
+class BBitMinHash(UniversalMinHash):
+    """
+    b-bit MinHash (Li and Konig, 2010): UniversalMinHash keeping only the lowest bits of every minimum. The signatures
+    hold values in [0, 2^bits) as uint8, and sign_matrix stores them packed into bytes, bits bits per hash function,
+    which takes 64 / bits times less memory than int64 signatures. Two documents of Jaccard similarity J agree on a b-bit
+    value with probability C + (1 - C) J, where C = 2^-bits is the chance that different minima share their lowest bits,
+    so the fraction P of agreeing values gives the unbiased estimate (P - C) / (1 - C).
+    """
+
+    def __init__(self, one_hot_matrix, nfuncs, seed=None, chunk_size=1 << 22, bits=1):
+        """
+        Same as UniversalMinHash, with the number of bits (1 to 8) kept per hash value.
+        Use functools.partial(BBitMinHash, bits=...) to pass another number of bits as the hash_family of LSH.
+        """
+        if not 1 <= bits <= 8:
+            raise ValueError("b-bit MinHash keeps between 1 and 8 bits per hash value")
+
+        # the signatures are uint8 from the start, the minima are masked chunk by chunk
+        super().__init__(one_hot_matrix, nfuncs, seed=seed, chunk_size=chunk_size, dtype=uint8)
+
+        self.bits = bits
+
+
+    def _reduce(self, minima):
+        """
+        Keeps the lowest bits of every minimum, so that the full minima never span all the documents.
+        """
+        return minima & ((1 << self.bits) - 1)
+
+
+    def perturbations(self, data):
+        """
+        The alternatives of every value are the lowest bits of the next minima, with the costs of UniversalMinHash.
+        """
+        values, costs = super().perturbations(data)
+
+        return (values & ((1 << self.bits) - 1)).astype(uint8), costs
+
+
+    def compact(self, sign_matrix):
+        """
+        Packs the bits of every column into bytes: the result has ceil(nfuncs * bits / 8) rows of uint8. The columns are
+        packed in chunks of about chunk_size bits, so that the unpacked bits of all the documents are never held at once.
+        """
+        shifts = arange(self.bits, dtype=uint8)[None, :, None]
+        packed = empty(((self.nfuncs * self.bits + 7) // 8, sign_matrix.shape[1]), dtype=uint8)
+
+        step = max(1, self.chunk_size // (self.nfuncs * self.bits))
+        for c in range(0, sign_matrix.shape[1], step):
+            bits = (sign_matrix[:, None, c:c+step] >> shifts) & 1
+            packed[:, c:c+step] = packbits(bits.reshape(self.nfuncs * self.bits, -1), axis=0)
+
+        return packed
+
+
+    def expand(self, stored):
+        """
+        Unpacks a packed matrix back to its b-bit values.
+        """
+        bits = unpackbits(stored, axis=0, count=self.nfuncs * self.bits).reshape(self.nfuncs, self.bits, -1)
+
+        return (bits << arange(self.bits, dtype=uint8)[None, :, None]).sum(axis=1, dtype=uint8)
+
+
+    def collision_probability(self, similarity):
+        """
+        Two documents of Jaccard similarity J agree on a b-bit value with probability C + (1 - C) J, where C = 2^-bits.
+        """
+        chance = 2. ** -self.bits
+
+        return chance + (1 - chance) * asarray(similarity)
+
+
+    def estimate(self, i, j):
+        """
+        The unbiased estimate (P - C) / (1 - C) of the Jaccard similarity, from the fraction P of agreeing b-bit values.
+        """
+        chance = 2. ** -self.bits
+
+        return (super().estimate(i, j) - chance) / (1 - chance)
+
+
+class WeightedMinHash(HashFamily):
+    """
+    Improved Consistent Weighted Sampling (ICWS, Ioffe 2010) for non-negative weighted documents, such as shingle counts
+    or TF-IDF vectors. Every hash function draws, for every row i, r_i and c_i from Gamma(2, 1) and b_i from U(0, 1).
+    The draws are not stored per row: they are derived from a seeded hash of the row id, for the rows of the documents
+    signed only, so the family holds 5 keys per function whatever the vocabulary, and signs any shingle id.
+    A row of weight w gets t_i = floor(ln(w) / r_i + b_i) and ln a_i = ln(c_i) - r_i (t_i - b_i + 1), and the hash value
+    of the document is the pair (i*, t_i*) of the row with the smallest a_i, encoded as i* * 2^32 + t_i*. Two documents
+    agree on a hash value with probability equal to their weighted Jaccard similarity sum(min(x, y)) / sum(max(x, y)).
+    All the functions are evaluated on the nonzeros at once, and the minima are found with minimum.reduceat.
+    """
+
+    metric = 'weighted_jaccard'
+
+    # signature of an empty column
+    empty_value = -1
+
+    def __init__(self, one_hot_matrix, nfuncs, seed=None, chunk_size=1 << 22):
+        super().__init__(one_hot_matrix, nfuncs, seed=seed, chunk_size=chunk_size)
+
+        if (self.columns.values < 0).any():
+            raise ValueError("Weighted MinHash needs non-negative weights")
+
+        # create hash functions
+        self.keys = self.build_functions(nfuncs)
+
+
+    def build_functions(self, nfuncs):
+        """
+        Draws the 5 keys of every hash function, one per uniform number its draws of a row are made of.
+        """
+        return default_rng(self.seed).integers(0, 1 << 63, size=(nfuncs, 5), dtype=int64).astype(uint64)
+
+
+    def _draws(self, rows):
+        """
+        Returns r, ln(c) and b of every hash function for the given rows, as matrices of shape (nfuncs, rows). The key of
+        every uniform number is mixed with the row id by the splitmix64 finalizer, whose top 53 bits give a uniform in
+        (0, 1); r and c are the sums of two exponentials, -ln(u1 u2), which follow Gamma(2, 1).
+        """
+        uniforms = []
+        for key in self.keys.T:
+            z = key[:, None] + rows.astype(uint64)[None] * uint64(0x9e3779b97f4a7c15)
+            z = (z ^ (z >> uint64(30))) * uint64(0xbf58476d1ce4e5b9)
+            z = (z ^ (z >> uint64(27))) * uint64(0x94d049bb133111eb)
+            z = z ^ (z >> uint64(31))
+            uniforms.append(((z >> uint64(11)).astype(float64) + .5) / (1 << 53))
+
+        u1, u2, u3, u4, b = uniforms
+
+        return -log(u1 * u2), log(-log(u3 * u4)), b
+
+
+    def signatures(self, data):
+        """
+        Computes the signatures of the documents in data (any input accepted by SparseColumns.from_data, with non-negative
+        weights). Rows of zero weight are ignored and documents without any positive weight get the empty signature.
+        """
+        columns = SparseColumns.from_data(data, n_rows=self.shape[0])
+
+        if (columns.values < 0).any():
+            raise ValueError("Weighted MinHash needs non-negative weights")
+
+        sign_matrix = full((self.nfuncs, len(columns)), self.empty_value, dtype=int64)
+
+        for c, stop, lo, hi, nonempty, offsets in self._chunks(columns):
+            rows, weights = columns.indices[lo:hi], columns.values[lo:hi].astype(float64)
+            r, log_c, b = self._draws(rows)
+
+            positive = weights > 0
+            log_weights = log(where(positive, weights, 1.))
+
+            t = floor(log_weights / r + b)
+            log_a = where(positive, log_c - r * (t - b + 1), inf)
+
+            # position of the first minimum of every column, for every function
+            lengths = diff(concatenate((offsets, [hi - lo])))
+            is_min = log_a == repeat(minimum.reduceat(log_a, offsets, axis=1), lengths, axis=1)
+            positions = minimum.reduceat(where(is_min, arange(hi - lo), hi - lo), offsets, axis=1)
+
+            functions = arange(self.nfuncs)[:, None]
+            values = rows[positions] * (1 << 32) + (t[functions, positions].astype(int64) & 0xffffffff)
+
+            # columns whose weights are all zero stay empty
+            values[~positive[positions]] = self.empty_value
+
+            sign_matrix[:, c:stop][:, nonempty] = values
+
+        return sign_matrix
+
+
+class SimHash(HashFamily):
+    """
+    Random hyperplane LSH (SimHash) for cosine similarity. Every hash function is a random Gaussian hyperplane and
+    the hash value of a document is the side of the hyperplane it falls on, so two documents at angle theta agree on
+    a hash value with probability 1 - theta / pi. All the hyperplanes are applied with one sparse matrix product.
+    """
+
+    metric = 'cosine'
+
+    fixed_vocabulary = True
+
+    def __init__(self, one_hot_matrix, nfuncs, seed=None, chunk_size=1 << 22):
+        super().__init__(one_hot_matrix, nfuncs, seed=seed, chunk_size=chunk_size)
+
+        # create hash functions
+        self.planes = self.build_functions(nfuncs)
+
+
+    def build_functions(self, nfuncs):
+        """
+        Draws the normal vectors of nfuncs random hyperplanes of the vocabulary space.
+        """
+        return default_rng(self.seed).standard_normal((nfuncs, self.shape[0]))
+
+
+    def signatures(self, data):
+        """
+        Computes the signature bits of the documents in data (any input accepted by SparseColumns.from_data).
+        """
+        return (self._project(data, self.planes) >= 0).astype(int8)
+
+
+    def perturbations(self, data):
+        """
+        The alternative of every bit is its flip. The closer a document lies to a hyperplane, the more likely a close
+        document falls on the other side, so the cost is the squared projection on the hyperplane normal.
+        """
+        projections = self._project(data, self.planes)
+
+        return (projections < 0).astype(int8)[:, None], (projections ** 2)[:, None]
+
+
+    def collision_probability(self, similarity):
+        """
+        Two documents of cosine similarity s are split by a random hyperplane with probability arccos(s) / pi.
+        """
+        return 1 - arccos(clip(similarity, -1, 1)) / pi
+
+
+    def estimate(self, i, j):
+        """
+        The cosine similarity cos(pi (1 - P)) of the angle estimated from the fraction P of agreeing bits.
+        """
+        return cos(pi * (1 - super().estimate(i, j)))
+
+
+class PStableHash(HashFamily):
+    """
+    p-stable LSH for euclidean distance, with Gaussian (2-stable) projections. Every hash function projects a document
+    on a random Gaussian direction a, shifts it by a random offset b and cuts the line in segments of the given width:
+    h(x) = floor((a.x + b) / width). Close documents fall in the same segment with high probability. All the
+    projections are applied with one sparse matrix product.
+    """
+
+    metric = 'euclidean'
+
+    fixed_vocabulary = True
+
+    def __init__(self, one_hot_matrix, nfuncs, seed=None, chunk_size=1 << 22, width=4.):
+        """
+        Same as HashFamily, with the width of the segments of every projection.
+        Use functools.partial(PStableHash, width=...) to pass another width as the hash_family of LSH.
+        """
+        super().__init__(one_hot_matrix, nfuncs, seed=seed, chunk_size=chunk_size)
+
+        self.width = width
+
+        # create hash functions
+        self.a, self.b = self.build_functions(nfuncs)
+
+
+    def build_functions(self, nfuncs):
+        """
+        Draws nfuncs Gaussian directions of the vocabulary space and their offsets in [0, width).
+        """
+        rng = default_rng(self.seed)
+
+        a = rng.standard_normal((nfuncs, self.shape[0]))
+        b = rng.uniform(0, self.width, size=nfuncs)
+
+        return a, b
+
+
+    def signatures(self, data):
+        """
+        Computes the segment indices of the documents in data (any input accepted by SparseColumns.from_data).
+        """
+        return floor((self._project(data, self.a) + self.b[:, None]) / self.width).astype(int64)
+
+
+    def perturbations(self, data):
+        """
+        The alternatives of every segment index are its two neighbor segments, h - 1 and h + 1. The cost of each is the
+        squared distance of the projection to the boundary shared with that segment, in units of width.
+        """
+        positions = (self._project(data, self.a) + self.b[:, None]) / self.width
+        segments = floor(positions)
+        offsets = positions - segments
+
+        values = stack((segments - 1, segments + 1), axis=1).astype(int64)
+        costs = stack((offsets ** 2, (1 - offsets) ** 2), axis=1)
+
+        return values, costs
+
+
+    def collision_probability(self, similarity):
+        """
+        The similarity s stands for the euclidean distance d = 1 / s - 1. Two documents at distance d fall in the same
+        segment with probability 1 - 2 Phi(-w/d) - 2 / (sqrt(2 pi) w/d) (1 - exp(-(w/d)^2 / 2)), with Phi the standard
+        normal distribution function (Datar et al., 2004).
+        """
+        distance = 1 / maximum(asarray(similarity, dtype=float64), 1e-12) - 1
+        ratio = self.width / maximum(distance, 1e-12)
+
+        phi = .5 * (1 + vectorize(erf)(-ratio / sqrt(2)))
+
+        return 1 - 2 * phi - 2 / (sqrt(2 * pi) * ratio) * (1 - exp(-ratio ** 2 / 2))
+
+
+    def estimate(self, i, j):
+        """
+        The similarity whose collision probability is the fraction of agreeing segments, inverted numerically.
+        """
+        similarities = linspace(0, 1, 1001)
+
+        return interp(super().estimate(i, j), self.collision_probability(similarities), similarities)
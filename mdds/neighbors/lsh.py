@@ -1,150 +1,232 @@
-from numpy import array, zeros, empty
-from random import shuffle 
+from numpy import array, zeros, empty, full, ones, arange, searchsorted, concatenate, cumsum, asarray, int64
+from numpy import ascontiguousarray, unique, argsort, dtype, void, repeat, diff, bincount, float64, flatnonzero, inf
+from numpy import ndarray, linspace, triu_indices
+from zlib import crc32
+from multiprocessing.shared_memory import SharedMemory
+from concurrent.futures import ProcessPoolExecutor
+from warnings import warn
 from itertools import combinations
-from copy import deepcopy
-from mdds.helpers import cosine_similarity
+from heapq import heappush, heappop
+from mdds.neighbors.sparse import SparseColumns
+from mdds.neighbors.hashing import MinHash, HashFamily, UniversalMinHash, OnePermutationHash, BBitMinHash, WeightedMinHash, SimHash, PStableHash
+from mdds.neighbors.persistence import LSHPersistence, SortedBuckets
 
 """
-The above code consists of two classes: MinHash and LSH. The MinHash class is used to generate a signature matrix
-of an input one-hot encoded matrix, and the LSH class is used to perform approximate nearest neighbor search on the
-signature matrix using Locality Sensitive Hashing (LSH).
-
-
-The MinHash class has the following methods and attributes:
-
-    __init__(self, one_hot_matrix, nfuncs): 
-       
-    _hash(self): 
-        
-    _signature_matrix(self):
-
+The LSH class is used to perform approximate nearest neighbor search on the signature matrix of the documents, computed
+by one of the hash families of hashing.py (MinHash, UniversalMinHash, OnePermutationHash, BBitMinHash, WeightedMinHash,
+SimHash, PStableHash), using Locality Sensitive Hashing (LSH). The documents are stored as SparseColumns (sparse.py), and
+the methods that save, load and fit a model out of core are inherited from LSHPersistence (persistence.py).
 
 
 The LSH class has the following methods and attributes:
 
-    __init__(self, nfuncs, bands): 
+    __init__(self, nfuncs, bands, hash_family, seed, n_jobs): 
         This method is the constructor of the class. It initializes the object with the number of hash functions (nfuncs), the number of
-        bands (bands) used to partition the signature matrix
+        bands (bands) used to partition the signature matrix, the class used to sign the documents (hash_family),
+        the seed of its hash functions and the number of processes (n_jobs) that sign and hash the documents in fit.
         The attribute hash_tables is initially set to None.
 
+    tune(cls, threshold, max_fp_weight, max_fn_weight, nfuncs_budget, sample, hash_family, seed, n_jobs):
+        This class method returns an LSH whose bands and rows per band are chosen for a similarity threshold, by minimizing
+        the weighted false positive and false negative areas under the S-curve within nfuncs_budget hash functions.
+        With a sample of documents, the choice is also checked against brute force, and the report kept in the tuning attribute.
+
     partition_into_bands(self, sm):
         This method partitions the signature matrix (sm) into bands number of bands.
 
     fit(self, data, buckets):
-        This method is used to fit the LSH model to the input data. It creates an object of the MinHash class with
+        This method is used to fit the LSH model to the input data. It creates an object of the hash_family class with
         the input data and nfuncs number of hash functions. It then creates the signature matrix using the _signature_matrix()
-        method from the MinHash class. It then partitions the signature matrix into bands and uses the hash values of the columns
-        of each band to create a list of hash tables with buckets number of buckets.
+        method of the hash family. It then partitions the signature matrix into bands and uses the hash values of the columns
+        of each band to create a list of hash tables with buckets number of buckets. When buckets is None, each hash table is
+        instead a dictionary keyed by the full band signature, so only columns with identical bands share a bucket.
+        With n_jobs > 1, the document columns are split in shards that a process pool signs and hashes in parallel.
+        The documents and the signature matrix live in shared memory, and the per shard buckets are merged at the end.
+        Only the vectorized families (HashFamily) sign shards of sparse columns; MinHash raises a ValueError.
 
     _get_candidates(self):
         This method finds candidate column pairs for the input matrix by looking for columns that have the same hash value
         in the same band of the signature matrix (items in same buckets). It returns a set of candidate column pairs.
 
-    neigbors(self, similarity, dist_function):
-        This method takes two arguments, the similar threshold and the function to measure distance between points.
-        It returns all the points that have similarity >= similar. This method finds similar columns in the input matrix based on the
-        similarity function passed as an argument. By default, it uses the cosine similarity function. It uses the _find_candidates()
-        method to find the candidate column pairs, then it filters false positives by their similarity and return the columns that
-        have a similarity greater than the specified threshold
-
-    get_nearest_neighbors(self, query, radius):
-        This method, tries to return the points that are similar to a query. This is done by hashing the query and returning the 
-        hashed bucket plus the buckets within the specified raddius.
-"""
-
-class MinHash:
-    def __init__(self, one_hot_matrix, nfuncs):
-        """
-        This method is the constructor of the class. It initializes the object with the input one-hot encoded matrix, the number
-        of hash functions (nfuncs), and the signature matrix (sign_matrix) which is initially set to None.
-        """
-
-        # one hot encoded matrix
-        self.one_hot_matrix = one_hot_matrix
+    partial_fit(self, docs):
+        This method adds new documents to a fitted model. They are signed with the stored hash functions and hashed
+        into the existing band tables, taking the next free document ids.
 
-        # store dimensionality
-        self.shape = one_hot_matrix.shape
-        
-        # vertical dimmensionality of signature M
-        self.nfuncs = nfuncs
+    query(self, doc, threshold, metric, probes):
+        This method returns the stored documents that are similar to a single new document. It signs the document, looks up
+        the bucket of each of its bands, and verifies the documents found there in the given metric. With probes > 0 it also
+        looks up the probes buckets per band of the cheapest perturbations of the signature (multi-probe LSH).
 
-        # create hash functions
-        self.functions = self.build_functions(nfuncs)
+    clusters(self, threshold, metric, estimate):
+        This method returns the cluster label of every stored document, as a NumPy array. Documents sharing a bucket are joined
+        with a union-find when their similarity is >= threshold. Bucket members are verified against the representative of
+        the bucket only, and only when the two are still in different clusters, so hot buckets cost a linear number of checks.
 
-        # signatures
-        self.sign_matrix = None
+    top_k(self, doc_id, k):
+        This method returns the k stored documents that share a bucket with the stored document doc_id and have the highest
+        similarity to it, estimated from the signatures only.
 
+    neigbors(self, similarity, dist_function, estimate):
+        This method takes two arguments, the similar threshold and the function to measure distance between points.
+        It returns all the points that have similarity >= similar. This method finds similar columns in the input matrix based on the
+        similarity function passed as an argument. By default, it uses the metric of the hash family. It uses the _find_candidates()
+        method to find the candidate column pairs, then it filters false positives by their similarity and return the columns that
+        have a similarity greater than the specified threshold. With estimate=True, the similarities are estimated from the
+        signatures in one vectorized pass and the pairs are ordered by decreasing estimate, so fit can drop the documents
+        (keep_data=False).
+
+    batch_neighbors(self, similar, metric, chunk_size):
+        This method is the vectorized counterpart of neighbors. It gathers all the candidate pairs into index arrays and
+        verifies them in chunks with SparseColumns.similarity, returning NumPy arrays (i, j, sim) of the pairs with
+        similarity >= similar. The metric defaults to the one of the hash family.
+
+    get_nearest_neighbors(self, query, probes, radius):
+        This method, tries to return the points that are similar to a query. This is done by hashing the query and returning the
+        documents of its buckets, plus those of the probes buckets per band closest to it. The hash families provide, through
+        their perturbations method, the alternative hash values a close document is likely to get and their costs, and
+        the perturbation sets of each band are visited by increasing total cost. The radius argument is deprecated.
+"""
 
-    def _hash(self):
-        """
-        This method creates a list of indices of the rows of the one-hot encoded matrix in a random order.
-        build_functions(self, nfuncs): This method builds nfuncs number of hash functions by calling the _hash() method.
-        """
 
-        # one_hot indices vector
-        hash_indices = list(range(1, self.shape[0]+1))
+def _area(y, x):
+    """
+    Integrates the samples y of a function at the points x with the trapezoidal rule.
+    """
+    return float(((y[1:] + y[:-1]) / 2 * diff(x)).sum())
 
-        # shuffle 
-        shuffle(hash_indices)
 
-        return hash_indices
+def _to_shared(arr):
+    """
+    Copies an array to a new shared memory block. Returns the block and the (name, shape, dtype) needed to attach to it.
+    """
+    shm = SharedMemory(create=True, size=max(1, arr.nbytes))
+    ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
 
+    return shm, (shm.name, arr.shape, arr.dtype.str)
 
-    # basically, it returns a 2D list of indices permutations
-    def build_functions(self, nfuncs):
-        return [self._hash() for _ in range(nfuncs)]
 
+def _sign_shard(lsh, family, specs, n_rows, lo, hi):
+    """
+    Worker of a parallel LSH.fit. Attaches to the shared documents and signature matrix, signs the columns lo..hi-1,
+    writes their signatures in place and returns the band tables of the shard, as built by an empty copy of the model.
+    """
+    blocks = [SharedMemory(name=name) for name, _, _ in specs]
 
-    # create hash method takes as input a one hot encoded vector 
-    # and produces a compressed vector signature for it
-    def _signature_matrix(self):
-        """
-        This method creates the signature matrix of the input one-hot encoded matrix using the hash functions created by
-        the build_functions() method. It assigns the signature matrix to the sign_matrix attribute of the class.
-        The method returns the signature matrix.
-        """
-        # sign_matrix = []
-        sign_matrix = empty(shape=(self.nfuncs, self.shape[1]), dtype=int)
+    try:
+        indptr, indices, values, sign_matrix = [ndarray(shape, dtype=dtype(dt), buffer=shm.buf)
+                                                for shm, (_, shape, dt) in zip(blocks, specs)]
 
-        for i, func in enumerate(self.functions):
+        start, stop = indptr[lo], indptr[hi]
+        shard = SparseColumns(indptr[lo:hi+1] - start, indices[start:stop], values[start:stop], n_rows)
 
-            perm_sign = zeros(self.shape[1])
+        signatures = family.signatures(shard)
+        sign_matrix[:, lo:hi] = signatures
 
-            j = 1
-            
-            while (perm_sign == 0).any():
-                
-                idx = func.index(j)
-                row = self.one_hot_matrix[idx]
+        lsh._hash_bands(signatures, offset=lo, empty_docs=diff(shard.indptr) == 0)
 
-                mask = (perm_sign == 0) & (row == 1)
-                perm_sign[mask] = j
+        del indptr, indices, values, sign_matrix, shard
+        return lsh.hash_tables
 
-                j += 1
-                
-            sign_matrix[i] = perm_sign
-        
-        self.sign_matrix = deepcopy(sign_matrix)
+    finally:
+        for shm in blocks:
+            shm.close()
 
-        return sign_matrix
 
-
-class LSH:
-    def __init__(self, nfuncs, bands):
+class LSH(LSHPersistence):
+    def __init__(self, nfuncs, bands, hash_family=UniversalMinHash, seed=None, n_jobs=1):
         """
         This method is the constructor of the class. It initializes the object with the number of hash functions (nfuncs), the number of
-        bands (bands) used to partition the signature matrix. The attribute hash_tables is initially an empty list.
+        bands (bands) used to partition the signature matrix, the class used to sign the documents (hash_family), the seed of its
+        hash functions and the number of processes used by fit (n_jobs). The attribute hash_tables is initially an empty list.
         """
         # shingle size
         self.nfuncs = nfuncs
         
         # define size of bands partition
         self.bands = bands
+
+        # signing method and the seed of its hash functions
+        self.hash_family = hash_family
+        self.seed = seed
+
+        # processes signing and hashing the documents
+        self.n_jobs = n_jobs
         
         # Initialize a list to store the hash tables
         self.hash_tables = []
         
 
+    @classmethod
+    def tune(cls, threshold, max_fp_weight=.5, max_fn_weight=.5, nfuncs_budget=256, sample=None, hash_family=UniversalMinHash, seed=None, n_jobs=1):
+        """
+        This method chooses the number of bands b and rows per band r for a similarity threshold, and returns an LSH
+        configured with them (nfuncs = b * r <= nfuncs_budget). Two documents of similarity s become candidates with
+        probability P(s) = 1 - (1 - p(s)^r)^b, where p is the collision probability of the hash family. The false positive
+        area is the integral of P over [0, threshold] and the false negative area the integral of 1 - P over [threshold, 1];
+        the chosen (b, r) minimizes max_fp_weight * fp + max_fn_weight * fn over all the splits within the budget.
+        If a sample of documents is given, a copy of the tuned model is fitted on it and its candidate pairs are checked
+        against the brute force pairs with similarity >= threshold (in the metric of the family). The areas, and the
+        empirical precision and recall of the check, are stored in the tuning attribute of the returned object, which
+        is left unfitted.
+        """
+        # the family only provides its collision probability here, so it is built on an empty input unless a sample is given
+        documents = sample if sample is not None else SparseColumns(zeros(1, dtype=int64), empty(0, dtype=int64), empty(0), 0)
+        family = hash_family(documents, nfuncs=1, seed=seed)
+
+        similarities = linspace(0, 1, 1001)
+        probabilities = asarray(family.collision_probability(similarities) if hasattr(family, 'collision_probability') else similarities, dtype=float64)
+
+        below, above = similarities <= threshold, similarities >= threshold
+
+        best = None
+        for b in range(1, nfuncs_budget + 1):
+            for r in range(1, nfuncs_budget // b + 1):
+                # S-curve of the split
+                candidate = 1 - (1 - probabilities ** r) ** b
+
+                fp = _area(candidate[below], similarities[below])
+                fn = _area(1 - candidate[above], similarities[above])
+                error = max_fp_weight * fp + max_fn_weight * fn
+
+                if best is None or (error, b * r) < (best[0], best[1] * best[2]):
+                    best = (error, b, r, fp, fn)
+
+        _, b, r, fp, fn = best
+
+        lsh = cls(b * r, b, hash_family=hash_family, seed=seed, n_jobs=n_jobs)
+        lsh.tuning = {'bands': b, 'rows': r, 'false_positive_area': fp, 'false_negative_area': fn}
+
+        if sample is not None:
+            # the check fits its own model, so the tuned one is not left holding the sample
+            lsh.tuning.update(cls(b * r, b, hash_family=hash_family, seed=seed, n_jobs=n_jobs)._check(sample, threshold))
+
+        return lsh
+
+
+    def _check(self, sample, threshold):
+        """
+        This method fits the model on a sample of documents in exact mode and compares its candidate pairs with the brute
+        force pairs of similarity >= threshold. It returns the number of both, the precision (the share of candidates that
+        are true pairs) and the recall (the share of true pairs that are candidates).
+        """
+        self.fit(sample)
+
+        columns = self.hash_mehod.columns
+        metric = getattr(self.hash_mehod, 'metric', 'jaccard')
+
+        # all pairs of the sample
+        i, j = triu_indices(len(columns), k=1)
+        sims = columns.similarity(i, j, metric=metric)
+
+        true_pairs = set(zip(i[sims >= threshold].tolist(), j[sims >= threshold].tolist()))
+        candidates = {(min(c1, c2), max(c1, c2)) for c1, c2 in set().union(*self._get_candidates())}
+
+        found = len(true_pairs & candidates)
+
+        return {'candidates': len(candidates), 'true_pairs': len(true_pairs),
+                'precision': found / len(candidates) if candidates else 1., 'recall': found / len(true_pairs) if true_pairs else 1.}
+
+
     # class method to partition signature matrix into b bands
     def partition_into_bands(self, sm):
         """
@@ -165,46 +247,353 @@ class LSH:
     
 
     # Hash each band of the matrix M to a hash table with k buckets
-    def fit(self, data, num_buckets):
+    def fit(self, data, num_buckets=None, keep_data=True):
         """
-        This method is used to fit the LSH model to the input data. It creates an object of the MinHash class with
+        This method is used to fit the LSH model to the input data. It creates an object of the hash_family class with
         the input data and nfuncs number of hash functions. It then creates the signature matrix using the _signature_matrix()
-        method from the MinHash class. It then partitions the signature matrix into bands and uses the hash values of the columns
+        method of the hash family. It then partitions the signature matrix into bands and uses the hash values of the columns
         of each band to create a list of hash tables with buckets number of buckets.
+        If num_buckets is None, every hash table is a dictionary keyed by the full band signature (its bytes), so unrelated
+        bands never collide and the candidates are exactly the band matches.
+        The data can be a dense one-hot matrix of shape (vocab, docs), a scipy sparse matrix of the same shape, or an
+        iterable of integer shingle-id sets, one per document, whatever the hash family.
+        With keep_data=False, the documents are dropped once signed and only the signatures are kept, so the model
+        answers with estimated similarities only (neighbors with estimate=True, top_k).
         """
 
         self.num_buckets = num_buckets
         
         # create and define as class attribute minhash object
-        self.hash_mehod = MinHash(data, nfuncs=self.nfuncs)
-       
-        # each column represent the signature of each document
-        sign_matrix = self.hash_mehod._signature_matrix()
+        self.hash_mehod = self.hash_family(data, nfuncs=self.nfuncs, seed=self.seed)
 
-        # split into bands
-        bands = self.partition_into_bands(sign_matrix)
+        self.hash_tables = self._empty_tables()
+
+        if self.n_jobs > 1:
+            # MinHash signs dense matrices only, and cannot sign a shard of sparse columns
+            if not isinstance(self.hash_mehod, HashFamily):
+                raise ValueError(f"n_jobs > 1 needs a HashFamily hash family, such as UniversalMinHash, not {type(self.hash_mehod).__name__}")
+
+            self._parallel_fit()
+
+        else:
+            # each column represent the signature of each document
+            sign_matrix = self.hash_mehod._signature_matrix()
+
+            self._hash_bands(sign_matrix, empty_docs=diff(self.hash_mehod.columns.indptr) == 0)
+
+        if not keep_data:
+            self.hash_mehod.columns = None
+
+        return self
+
+
+    def _empty_tables(self):
+        """
+        This method creates an empty hash table with k buckets for each band, or an exact one keyed by band signature.
+        """
+        if self.num_buckets is None:
+            return [{} for _ in range(self.bands)]
+
+        return [[set() for _ in range(self.num_buckets)] for _ in range(self.bands)]
+
+
+    def _parallel_fit(self):
+        """
+        This method signs and hashes the documents with a pool of n_jobs processes. The documents and the signature matrix
+        are placed in shared memory, every process handles a contiguous shard of columns with the same pickled hash
+        functions, and the band tables of the shards are merged into the model.
+        """
+        columns = self.hash_mehod.columns
+
+        # the dtype of the signatures, from an empty input
+        empty_signature = self.hash_mehod.signatures(SparseColumns(columns.indptr[:1], columns.indices[:0], columns.values[:0], columns.shape[0]))
+
+        arrays = [columns.indptr, columns.indices, columns.values, empty((self.nfuncs, len(columns)), dtype=empty_signature.dtype)]
+        blocks, specs = zip(*[_to_shared(arr) for arr in arrays])
+
+        # an empty copy of the model, shipped to the workers to hash their shards
+        template = LSH(self.nfuncs, self.bands)
+        template.num_buckets = self.num_buckets
+        template.hash_tables = self._empty_tables()
+
+        bounds = linspace(0, len(columns), 4 * self.n_jobs + 1).astype(int)
+        shards = [(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.n_jobs) as pool:
+                futures = [pool.submit(_sign_shard, template, self.hash_mehod, specs, columns.shape[0], lo, hi) for lo, hi in shards]
+
+                for future in futures:
+                    for hash_table, shard_table in zip(self.hash_tables, future.result()):
+                        if isinstance(hash_table, dict):
+                            for key, bucket in shard_table.items():
+                                hash_table.setdefault(key, set()).update(bucket)
+                        else:
+                            for bucket, shard_bucket in zip(hash_table, shard_table):
+                                bucket |= shard_bucket
+
+            _, shape, dt = specs[-1]
+            self.hash_mehod.sign_matrix = self._compact(ndarray(shape, dtype=dtype(dt), buffer=blocks[-1].buf).copy())
+
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+
+    def _compact(self, sign_matrix):
+        """
+        This method returns the form in which the hash family stores a signature matrix.
+        """
+        return self.hash_mehod.compact(sign_matrix) if hasattr(self.hash_mehod, 'compact') else sign_matrix
+
+
+    def _documents(self):
+        """
+        This method returns the stored documents, which fit drops with keep_data=False.
+        """
+        if self.hash_mehod.columns is None:
+            raise ValueError("The documents were dropped by fit(keep_data=False), only estimated similarities are available")
+
+        return self.hash_mehod.columns
+
+
+    def _signature(self, doc_id):
+        """
+        This method returns the signature of a stored document, expanded from its stored form.
+        """
+        stored = self.hash_mehod.sign_matrix[:, [doc_id]]
+
+        return (self.hash_mehod.expand(stored) if hasattr(self.hash_mehod, 'expand') else stored)[:, 0]
+
+
+    def _estimate(self, i, j, chunk_size=1 << 16):
+        """
+        This method estimates the similarity of the stored document pairs (i[k], j[k]) from their signatures only, with the
+        estimator of the hash family, or as the fraction of agreeing hash values. Pairs are processed in chunks of chunk_size.
+        """
+        i, j = asarray(i, dtype=int64), asarray(j, dtype=int64)
+        sims = empty(len(i), dtype=float64)
+
+        for lo in range(0, len(i), chunk_size):
+            ci, cj = i[lo:lo+chunk_size], j[lo:lo+chunk_size]
+
+            if hasattr(self.hash_mehod, 'estimate'):
+                sims[lo:lo+chunk_size] = self.hash_mehod.estimate(ci, cj)
+            else:
+                sign_matrix = self.hash_mehod.sign_matrix
+                sims[lo:lo+chunk_size] = (sign_matrix[:, ci] == sign_matrix[:, cj]).mean(axis=0)
+
+        return sims
+
+
+    def _bucket_key(self, column):
+        """
+        This method returns the bucket of a band column in its hash table: the bytes of the column in exact mode,
+        their CRC32 modulo num_buckets otherwise. Unlike the salted hash() of Python, both are the same in every process.
+        """
+        key = ascontiguousarray(column).tobytes()
+
+        if self.num_buckets is None:
+            return key
+
+        return crc32(key) % self.num_buckets
+
+
+    def _buckets(self, hash_table):
+        """
+        This method returns the buckets of a hash table, whether it is a list of buckets, an exact dictionary or SortedBuckets.
+        """
+        return hash_table if isinstance(hash_table, list) else hash_table.values()
 
-        # for each band
-        for band in bands:
 
-            # Create an empty hash table with k buckets
-            hash_table = [set() for _ in range(self.num_buckets)]
+    def _bucket(self, hash_table, key):
+        """
+        This method returns the bucket of a key in a hash table, empty if the key has no bucket.
+        """
+        return hash_table[key] if isinstance(hash_table, list) else hash_table.get(key, set())
+
+
+    def _hash_bands(self, sign_matrix, offset=0, empty_docs=None):
+        """
+        This method splits the signature matrix into bands, and hashes each column j of every band into the hash table
+        of the band, under the document id offset + j. The columns of the empty documents (where the boolean mask empty_docs
+        is set) are left out: they all share the same signature, and would otherwise be candidates to each other.
+        """
+        ids = arange(sign_matrix.shape[1]) if empty_docs is None else flatnonzero(~asarray(empty_docs))
+        sign_matrix = sign_matrix[:, ids]
+
+        for hash_table, band in zip(self.hash_tables, self.partition_into_bands(sign_matrix)):
+
+            if isinstance(hash_table, dict):
+                # group the columns with identical band signatures, then add each group to its bucket
+                columns = ascontiguousarray(band.T)
+                keys = columns.view(dtype((void, columns.dtype.itemsize * columns.shape[1]))).ravel()
+
+                groups, inverse = unique(keys, return_inverse=True)
+                order = argsort(inverse, kind='stable')
+                bounds = searchsorted(inverse[order], arange(len(groups) + 1))
+
+                for g, key in enumerate(groups):
+                    hash_table.setdefault(key.tobytes(), set()).update((ids[order[bounds[g]:bounds[g+1]]] + offset).tolist())
+
+                continue
 
             # Hash each column of the band to a bucket in the hash table
-            for j, column in enumerate(band.T):
+            for j, column in zip(ids.tolist(), band.T):
+                hash_table[self._bucket_key(column)].add(offset + j)
+
+
+    def partial_fit(self, docs, num_buckets=None):
+        """
+        This method adds new documents to the model without refitting it. The documents are signed with the stored
+        hash functions and hashed into the existing band tables, taking the ids following the ones already stored.
+        If the model is not fitted yet, it is fitted on docs with num_buckets buckets.
+        """
+        if not self.hash_tables:
+            return self.fit(docs, num_buckets)
+
+        # tables read from disk become writable again
+        if isinstance(self.hash_tables[0], SortedBuckets):
+            self.hash_tables = [dict(hash_table) if self.num_buckets is None else [hash_table.get(i, set()) for i in range(self.num_buckets)]
+                                for hash_table in self.hash_tables]
 
-                # Compute the hash value of the column
-                hash_value = hash(tuple(column)) % self.num_buckets
+        # sign the new documents only
+        columns = SparseColumns.from_data(docs, n_rows=self.hash_mehod.shape[0])
+        sign_matrix = self.hash_mehod.signatures(columns)
 
-                # Add the column to the corresponding bucket in the hash table
-                hash_table[hash_value].add(j)
+        offset = self.hash_mehod.sign_matrix.shape[1]
 
-            # Add the hash table to the list
-            self.hash_tables.append(hash_table)
+        # store the documents, unless fit dropped them, and their signatures next to the previous ones
+        if self.hash_mehod.columns is not None:
+            self.hash_mehod.columns.append(columns)
+            self.hash_mehod.shape = self.hash_mehod.columns.shape
+        self.hash_mehod.sign_matrix = concatenate((self.hash_mehod.sign_matrix, self._compact(sign_matrix)), axis=1)
+
+        self._hash_bands(sign_matrix, offset, empty_docs=diff(columns.indptr) == 0)
 
         return self
 
 
+    @staticmethod
+    def _as_documents(doc):
+        """
+        This method wraps a single document, a one-hot vector or a set of shingle ids, into an input of one document.
+        """
+        if hasattr(doc, 'tocsc'):
+            return doc
+
+        if hasattr(doc, 'ndim'):
+            return doc.reshape(-1, 1)
+
+        return [doc]
+
+
+    def _probe_sequence(self, costs, probes):
+        """
+        This method generates the cheapest perturbation sets of a band, following the query-directed probing sequence of
+        multi-probe LSH (Lv et al., 2007). The perturbations are sorted by cost and a heap of sets of their sorted positions
+        is expanded from {0}: a popped set yields its shift (last position + 1) and its expansion (adding last position + 1),
+        so the sets come out by increasing total cost. Sets perturbing a function twice are skipped.
+        costs has shape (functions, alternatives); it returns up to probes lists of (function, alternative) pairs.
+        """
+        flat = costs.ravel()
+        order = argsort(flat, kind='stable')
+
+        # drop the impossible perturbations
+        order = order[flat[order] < inf]
+        sorted_costs = flat[order]
+
+        sequence = []
+        heap = [(sorted_costs[0], (0,))] if len(order) else []
+
+        while heap and len(sequence) < probes:
+            score, positions = heappop(heap)
+
+            last = positions[-1]
+            if last + 1 < len(order):
+                heappush(heap, (score - sorted_costs[last] + sorted_costs[last+1], positions[:-1] + (last + 1,)))
+                heappush(heap, (score + sorted_costs[last+1], positions + (last + 1,)))
+
+            perturbation = [divmod(int(order[k]), costs.shape[1]) for k in positions]
+
+            # a function takes a single alternative value
+            if len({function for function, _ in perturbation}) == len(perturbation):
+                sequence.append(perturbation)
+
+        return sequence
+
+
+    def _bucket_candidates(self, signature, probes=0, perturbations=None):
+        """
+        This method returns the ids of the stored documents that share the bucket of at least one band with a signature.
+        With probes > 0, it also visits in every band the probes buckets of the cheapest perturbations of the signature,
+        given as the (values, costs) arrays of shape (nfuncs, alternatives) of the hash family.
+        """
+        r = self.nfuncs // self.bands
+
+        candidates = set()
+        for i, hash_table in enumerate(self.hash_tables):
+            band = signature[i*r:(i+1)*r]
+
+            keys = [self._bucket_key(band)]
+
+            if probes and perturbations is not None:
+                values, costs = perturbations[0][i*r:(i+1)*r], perturbations[1][i*r:(i+1)*r]
+
+                for perturbation in self._probe_sequence(costs, probes):
+                    probe = band.copy()
+                    for function, alternative in perturbation:
+                        probe[function] = values[function, alternative]
+                    keys.append(self._bucket_key(probe))
+
+            for key in keys:
+                candidates |= self._bucket(hash_table, key)
+
+        return candidates
+
+
+    def _probe_candidates(self, docs, probes):
+        """
+        This method signs a single document and returns the candidates of its buckets, probing probes more buckets per
+        band when the hash family provides perturbations.
+        """
+        signature = self.hash_mehod.signatures(docs)[:, 0]
+
+        perturbations = None
+        if probes and hasattr(self.hash_mehod, 'perturbations'):
+            values, costs = self.hash_mehod.perturbations(docs)
+            perturbations = values[..., 0], costs[..., 0]
+
+        return self._bucket_candidates(signature, probes, perturbations)
+
+
+    def query(self, doc, threshold=.6, metric=None, probes=0):
+        """
+        This method returns the stored documents that are similar to a single new document (a one-hot vector or a set of
+        shingle ids). The document is signed with the stored hash functions in O(nfuncs) and looked up in one bucket per band.
+        With probes > 0 (multi-probe LSH), every band also visits the probes nearby buckets most likely to hold close
+        documents, which trades tables for lookups: few bands with probes come close to the recall of many bands for
+        SimHash, and recover part of it for the MinHash families, whose alternatives are limited to the hash values of
+        the document itself.
+        The documents found are verified together with SparseColumns.similarity, on the candidate columns followed by the
+        document, in the given metric (by default the one of the hash family), so the document may hold shingle ids the
+        stored documents do not. Those with similarity >= threshold are returned as a dictionary of document id to similarity.
+        """
+        metric = metric or getattr(self.hash_mehod, 'metric', 'jaccard')
+
+        docs = self._as_documents(doc)
+
+        candidates = array(sorted(self._probe_candidates(docs, probes)), dtype=int64)
+
+        columns = self._documents().take(candidates).append(SparseColumns.from_data(docs, n_rows=self.hash_mehod.shape[0]))
+        sims = columns.similarity(arange(len(candidates)), full(len(candidates), len(candidates)), metric=metric)
+
+        keep = sims >= threshold
+
+        return dict(zip(candidates[keep].tolist(), sims[keep].tolist()))
+
+
     # Find the candidate column pairs for the matrix M
     def cands(self):
 
@@ -215,12 +604,12 @@ class LSH:
       for hash_table in self.hash_tables:
 
         # For each bucket in the hash table
-        for bucket in hash_table:
+        for bucket in self._buckets(hash_table):
 
           # If there is more than one column in the bucket
           if len(bucket) > 1:
-            # Add all pairs of columns in the bucket to the candidates set
-            candidates.update(combinations(bucket, 2))
+            # Add all pairs of columns in the bucket to the candidates set, as (smaller id, larger id)
+            candidates.update(combinations(sorted(bucket), 2))
             
       # Return the candidate column pairs
       return candidates
@@ -230,8 +619,14 @@ class LSH:
         """
         This method finds candidate column pairs for the input matrix by looking for columns that have the same hash value
         in the same band of the signature matrix (items in same buckets). It returns a set of candidate column pairs.
+        In exact mode it returns one set of candidate pairs per band. Every pair is (i, j) with i < j, so the same pair
+        found in several buckets or bands is verified once.
         """
 
+        if self.num_buckets is None:
+            return [set().union(*(combinations(sorted(bucket), 2) for bucket in hash_table.values() if len(bucket) > 1))
+                    for hash_table in self.hash_tables]
+
         # Initialize a set to store the candidate column pairs
         candidates = [set() for _ in range(self.num_buckets)]
 
@@ -239,29 +634,49 @@ class LSH:
         for hash_table in self.hash_tables:
 
             # For each bucket in the hash table
-            for i, bucket in enumerate(hash_table):
+            for i, bucket in (enumerate(hash_table) if isinstance(hash_table, list) else hash_table.items()):
 
                 # If there is more than one column in the bucket
                 if len(bucket) > 1:
 
-                    # Add all pairs of columns in the bucket to the candidates set
-                    candidates[i].update(combinations(bucket, 2))
+                    # Add all pairs of columns in the bucket to the candidates set, as (smaller id, larger id)
+                    candidates[i].update(combinations(sorted(bucket), 2))
 
         # Return the candidate column pairs
         return candidates  
       
 
-    def neighbors(self, similar=.6, dist_func=cosine_similarity):
+    def neighbors(self, similar=.6, dist_func=None, estimate=False):
         """
         This method takes two arguments, the similar threshold and the function to measure distance between points.
         It returns all the points that have similarity >= similar. This method finds similar columns in the input matrix based on the
-        similarity function passed as an argument. By default, it uses the cosine similarity function. It uses the _find_candidates()
+        similarity function passed as an argument. By default, it verifies the pairs in the metric of the hash family (the one
+        its candidates were generated for), with SparseColumns.similarity. It uses the _find_candidates()
         method to find the candidate column pairs, then it filters false positives by their similarity and return the columns that
-        have a similarity greater than the specified threshold
+        have a similarity greater than the specified threshold.
+        With estimate=True, dist_func is not used: the similarity of every candidate pair is estimated from the signatures
+        (the Jaccard similarity for MinHash), for all the pairs at once, and the pairs are ordered by decreasing estimate.
         """
         
         # fetch unfiltered candidates
         cands = set().union(*self._get_candidates())
+
+        if estimate:
+            pairs = array(list(cands), dtype=int64).reshape(-1, 2)
+            sims = self._estimate(pairs[:, 0], pairs[:, 1])
+
+            keep = flatnonzero(sims >= similar)
+            keep = keep[argsort(-sims[keep], kind='stable')]
+
+            return {(int(c1), int(c2)): float(sim) for (c1, c2), sim in zip(pairs[keep], sims[keep])}
+
+        if dist_func is None:
+            pairs = array(sorted(cands), dtype=int64).reshape(-1, 2)
+            sims = self._documents().similarity(pairs[:, 0], pairs[:, 1], metric=getattr(self.hash_mehod, 'metric', 'jaccard'))
+
+            keep = sims >= similar
+
+            return {(int(c1), int(c2)): float(sim) for (c1, c2), sim in zip(pairs[keep], sims[keep])}
         
         actual_neigbors = {}
 
@@ -269,7 +684,7 @@ class LSH:
         for c1, c2 in cands:
 
             # get similarity
-            sim = dist_func(self.hash_mehod.one_hot_matrix[:, c1], self.hash_mehod.one_hot_matrix[:, c2])
+            sim = dist_func(self._documents().column(c1), self._documents().column(c2))
             
             # if above given threshold
             if sim >= similar: actual_neigbors[c1, c2] = sim 
@@ -277,23 +692,145 @@ class LSH:
         return actual_neigbors
 
 
-    def get_nearest_neighbors(self, query, radius=.1):
+    def batch_neighbors(self, similar=.6, metric=None, chunk_size=1 << 16):
         """
-        This method, tries to return the points that are similar to a query. This is done by hashing the query and returning the 
-        hashed bucket plus the buckets within the specified raddius.
+        This method is the vectorized counterpart of neighbors. It gathers the candidate pairs into index arrays and verifies
+        them in chunks of chunk_size pairs with SparseColumns.similarity, which uses the column norms computed once.
+        The metric is 'cosine', 'jaccard' or 'euclidean', by default the one of the hash family, so that candidates are
+        verified with the measure they were generated for. It returns three NumPy arrays (i, j, sim) holding the pairs
+        with similarity >= similar, every pair once with i < j.
         """
-        
-        # get concatenated form of hashed band buckets
-        buckets = self._get_candidates()
-        
-        # create hash value for the query item
-        query_hash = hash(tuple(query)) % self.num_buckets
-        
-        # neibgor buckets index
-        index = int((len(buckets) * radius)//2)
+        metric = metric or getattr(self.hash_mehod, 'metric', 'jaccard')
+
+        # fetch unfiltered candidates
+        cands = array(list(set().union(*self._get_candidates())), dtype=int64).reshape(-1, 2)
+
+        i, j = cands[:, 0], cands[:, 1]
+        sims = self._documents().similarity(i, j, metric=metric, chunk_size=chunk_size)
+
+        keep = sims >= similar
+
+        return i[keep], j[keep], sims[keep]
+
+
+    def _bucket_arrays(self, hash_table):
+        """
+        This method returns the buckets of a hash table with more than one document as two arrays: the document ids,
+        sorted within every bucket and one bucket after the other, and the bucket number of every id.
+        """
+        if isinstance(hash_table, SortedBuckets):
+            lengths = diff(hash_table.offsets)
+            groups = repeat(arange(len(lengths)), lengths)
+            keep = lengths[groups] > 1
+
+            return asarray(hash_table.ids)[keep], groups[keep]
+
+        buckets = [sorted(bucket) for bucket in self._buckets(hash_table) if len(bucket) > 1]
+
+        ids = array([c for bucket in buckets for c in bucket], dtype=int64)
+        groups = repeat(arange(len(buckets)), [len(bucket) for bucket in buckets])
+
+        return ids, groups
 
-        # include left and right neigbor buckets within the radius
-        cands = set.union(*buckets[index:query_hash-1], buckets[query_hash], *buckets[query_hash+1:index])
 
-        return cands
+    def clusters(self, threshold=.6, metric=None, estimate=False):
+        """
+        This method groups the stored documents into clusters of near duplicates and returns their labels, a NumPy array
+        with the cluster (0, 1, ...) of every document. It runs a union-find over the document ids. Within every bucket of
+        every band, the members are verified against the representative of the bucket (its smallest id), and joined to its
+        cluster if their similarity is >= threshold; members already in that cluster are joined without verification.
+        The members left form a smaller bucket with its own representative, and so on until no bucket is left, so a bucket
+        holding k clusters of b documents costs about k * b verified edges instead of b^2 / 2 candidate pairs, and a hot
+        bucket of near duplicates b - 1 edges. The edges of a round are verified together over all the buckets of the band,
+        with SparseColumns.similarity in the given metric (by default the one of the hash family), or with the estimates
+        of the signatures if estimate is True.
+        """
+        metric = metric or getattr(self.hash_mehod, 'metric', 'jaccard')
+
+        parent = arange(self.hash_mehod.sign_matrix.shape[1])
+
+        def find(x):
+            # path halving
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        def compress():
+            # point every document to its root, all at once
+            while True:
+                grandparent = parent[parent]
+                if (grandparent == parent).all():
+                    return
+                parent[:] = grandparent
+
+        for hash_table in self.hash_tables:
+            ids, groups = self._bucket_arrays(hash_table)
+
+            while len(ids):
+                # the first id of every bucket is its representative
+                starts = ones(len(ids), dtype=bool)
+                starts[1:] = groups[1:] != groups[:-1]
+
+                representatives = ids[starts][cumsum(starts) - 1][~starts]
+                members, member_groups = ids[~starts], groups[~starts]
+
+                compress()
+                joined = parent[representatives] == parent[members]
+
+                # verify the edges across clusters only
+                apart = flatnonzero(~joined)
+                if estimate:
+                    sims = self._estimate(representatives[apart], members[apart])
+                else:
+                    sims = self._documents().similarity(representatives[apart], members[apart], metric=metric)
+
+                for a, b in zip(representatives[apart[sims >= threshold]].tolist(), members[apart[sims >= threshold]].tolist()):
+                    root_a, root_b = find(a), find(b)
+                    if root_a != root_b:
+                        parent[max(root_a, root_b)] = min(root_a, root_b)
+
+                joined[apart[sims >= threshold]] = True
+
+                # the members left, in buckets of at least two
+                ids, groups = members[~joined], member_groups[~joined]
+                sizes = bincount(groups)
+                ids, groups = ids[sizes[groups] > 1], groups[sizes[groups] > 1]
+
+        compress()
+
+        return unique(parent, return_inverse=True)[1].reshape(-1)
+
+
+    def top_k(self, doc_id, k=10):
+        """
+        This method returns the k stored documents most similar to the stored document doc_id, among those sharing a bucket
+        with it, as two NumPy arrays (ids, estimates) ordered by decreasing estimate. The similarities are estimated from
+        the signatures, for all the candidates at once, so the documents themselves are not needed.
+        """
+        candidates = self._bucket_candidates(self._signature(doc_id))
+        candidates.discard(doc_id)
+
+        ids = array(sorted(candidates), dtype=int64)
+        sims = self._estimate(full(len(ids), doc_id), ids)
+
+        best = argsort(-sims, kind='stable')[:k]
+
+        return ids[best], sims[best]
+
+    def get_nearest_neighbors(self, query, probes=2, radius=None):
+        """
+        This method, tries to return the points that are similar to a query. This is done by hashing the query and returning the
+        documents of its bucket in every band, plus the documents of the probes nearby buckets per band most likely to hold
+        close documents, ranked by how close the query lies to the boundaries of its hash values (multi-probe LSH).
+        The candidates are not verified.
+        radius, the share of the buckets around the query that was visited before multi-probe queries, is deprecated:
+        it is turned into probes = radius * num_buckets / 2 nearby buckets per band (or ignored in exact mode).
+        """
+        if radius is not None:
+            warn("radius is deprecated, use probes, the number of nearby buckets visited per band", DeprecationWarning, stacklevel=2)
+
+            if self.num_buckets is not None:
+                probes = int(self.num_buckets * radius) // 2
 
+        return self._probe_candidates(self._as_documents(query), probes)
@@ -0,0 +1,464 @@
+from numpy import array, zeros, empty, arange, searchsorted, concatenate, cumsum, asarray, int64, ascontiguousarray
+from numpy import argsort, dtype, void, diff, flatnonzero, generic, ndarray, frombuffer, save, load
+from json import dump, load as load_json
+from os import makedirs, remove, rmdir
+from os.path import join
+from shutil import copyfileobj
+from itertools import chain
+from heapq import merge
+from numpy.lib.format import open_memmap, write_array_header_1_0, dtype_to_descr
+from importlib import import_module
+from collections.abc import Mapping
+from mdds.neighbors.sparse import SparseColumns
+
+"""
+The LSHPersistence class holds the methods of LSH that store a model on disk, which LSH inherits: save writes a fitted
+model to a directory of .npy files and a meta.json file, load reads it back, memory mapped, and fit_stream builds it there
+out of core. The band tables of a loaded model are SortedBuckets.
+
+
+The SortedBuckets class is the read-only hash table of a band, stored as arrays: the sorted bucket keys, the offsets of the
+buckets and the document ids of all the buckets one after the other. A key is looked up with a binary search on the keys.
+
+
+The LSHPersistence class has the following methods and attributes:
+
+    save(self, path):
+        This method writes a fitted model to the directory path: its parameters and the scalar parameters of the hash family
+        as JSON, and the arrays of the hash functions, the documents, the signature matrix and the buckets of every band as
+        .npy files. Every band is stored as its sorted bucket keys, the offsets of the buckets and their document ids.
+
+    load(cls, path, mmap):
+        This class method reads a model written by save. With mmap, the arrays are memory mapped instead of read, so loading
+        costs no time, and processes that load the same index share its pages. The band tables are SortedBuckets, which
+        look up a key with a binary search.
+
+    fit_stream(self, chunks, path, num_buckets, n_rows, keep_data, block_size):
+        This method fits the model out of core on an iterator of chunks of documents. Every chunk is signed and its
+        (band, key, doc_id) records are written to a sorted run file; an external heap merge of the runs then writes the
+        bucket arrays of every band to path, in the format of save, and the model is loaded back memory mapped.
+        Memory is bounded by the chunk size, not by the size of the corpus.
+"""
+
+
+def _write_npy(path, raw_path, dt, shape, fortran_order=False):
+    """
+    Turns a raw file of array data, written piece by piece, into the .npy file path of the given dtype and shape,
+    without reading it into memory. The raw file is removed.
+    """
+    with open(path, 'wb') as f:
+        write_array_header_1_0(f, {'descr': dtype_to_descr(dtype(dt)), 'fortran_order': fortran_order, 'shape': shape})
+
+        with open(raw_path, 'rb') as raw:
+            copyfileobj(raw, f)
+
+    remove(raw_path)
+
+
+def _run_records(run, block_size):
+    """
+    Yields the (band, key, doc_id) records of a sorted run file as tuples, reading it block by block.
+    """
+    records = load(run, mmap_mode='r')
+
+    for lo in range(0, len(records), block_size):
+        block = records[lo:lo+block_size]
+
+        keys = block['key']
+        keys = [key.tobytes() for key in keys] if keys.dtype.kind == 'V' else keys.tolist()
+
+        yield from zip(block['band'].tolist(), keys, block['doc'].tolist())
+
+
+class _BandWriter:
+    """
+    Writes the merged (key, doc_id) records of a band, sorted by key, to the bucket arrays of the band in path: the
+    document ids go to a memory mapped .npy file of n_docs ids, the distinct keys and the offsets of their buckets to raw
+    files turned into .npy files by close. Records are buffered and written every block_size documents.
+    """
+
+    def __init__(self, path, band, key, n_docs, block_size):
+        self.path, self.band, self.block_size = path, band, block_size
+
+        # the exact keys are bytes of a fixed length, the other ones bucket indices
+        self.key_dtype = dtype((void, len(key))) if isinstance(key, bytes) else dtype(int64)
+
+        self.ids = open_memmap(join(path, f'band_{band}_ids.npy'), mode='w+', dtype=int64, shape=(n_docs,))
+        self.keys_file = open(join(path, f'band_{band}_keys.raw'), 'wb')
+        self.offsets_file = open(join(path, f'band_{band}_offsets.raw'), 'wb')
+
+        self.keys, self.offsets, self.docs = [], [], []
+        self.n_keys, self.written, self.last = 0, 0, None
+
+
+    def add(self, key, doc):
+        # a new bucket starts at every new key
+        if key != self.last:
+            self.keys.append(key)
+            self.offsets.append(self.written + len(self.docs))
+            self.n_keys += 1
+            self.last = key
+
+        self.docs.append(doc)
+
+        if len(self.docs) >= self.block_size:
+            self.flush()
+
+
+    def flush(self):
+        if self.key_dtype.kind == 'V':
+            self.keys_file.write(b''.join(self.keys))
+        else:
+            self.keys_file.write(array(self.keys, dtype=int64).tobytes())
+
+        self.offsets_file.write(array(self.offsets, dtype=int64).tobytes())
+
+        self.ids[self.written:self.written+len(self.docs)] = self.docs
+        self.written += len(self.docs)
+
+        self.keys, self.offsets, self.docs = [], [], []
+
+
+    def close(self):
+        # the end of the last bucket
+        self.offsets.append(self.written + len(self.docs))
+        self.flush()
+
+        self.ids.flush()
+        self.keys_file.close()
+        self.offsets_file.close()
+
+        band_path = join(self.path, f'band_{self.band}')
+        _write_npy(band_path + '_keys.npy', band_path + '_keys.raw', self.key_dtype, (self.n_keys,))
+        _write_npy(band_path + '_offsets.npy', band_path + '_offsets.raw', int64, (self.n_keys + 1,))
+
+        del self.ids
+
+
+class SortedBuckets(Mapping):
+    """
+    Read-only hash table of a band, stored as arrays: the sorted bucket keys (void bytes of the band signature in exact
+    mode, bucket indices otherwise), the offsets of the buckets and the document ids of all the buckets one after the other.
+    A key is looked up with a binary search on the keys, and its bucket is returned as a set of document ids.
+    """
+
+    def __init__(self, sorted_keys, offsets, ids):
+        self.sorted_keys = sorted_keys
+        self.offsets = offsets
+        self.ids = ids
+
+
+    @classmethod
+    def from_table(cls, hash_table):
+        """
+        Converts a band table, a dictionary of bytes keys or a list of buckets, to sorted arrays.
+        """
+        if isinstance(hash_table, dict):
+            # the exact keys are the bytes of the band signatures, all of the same length
+            width = max(1, len(next(iter(hash_table), b'')))
+            keys = frombuffer(b''.join(hash_table.keys()), dtype=dtype((void, width)))
+            buckets = list(hash_table.values())
+        else:
+            keys = array([i for i, bucket in enumerate(hash_table) if bucket], dtype=int64)
+            buckets = [bucket for bucket in hash_table if bucket]
+
+        order = argsort(keys, kind='stable')
+        buckets = [sorted(buckets[k]) for k in order]
+
+        offsets = concatenate(([0], cumsum([len(bucket) for bucket in buckets]))).astype(int64)
+        ids = array([c for bucket in buckets for c in bucket], dtype=int64)
+
+        return cls(keys[order], offsets, ids)
+
+
+    def _position(self, key):
+        """
+        Returns the position of a key in sorted_keys, or None if it is not stored.
+        """
+        if isinstance(key, bytes):
+            if len(key) != self.sorted_keys.dtype.itemsize:
+                return None
+            key = void(key)
+
+        k = int(searchsorted(self.sorted_keys, key))
+
+        return k if k < len(self.sorted_keys) and self.sorted_keys[k] == key else None
+
+
+    def __getitem__(self, key):
+        k = self._position(key)
+        if k is None:
+            raise KeyError(key)
+
+        return set(self.ids[self.offsets[k]:self.offsets[k+1]].tolist())
+
+
+    def __contains__(self, key):
+        return self._position(key) is not None
+
+
+    def __iter__(self):
+        for key in self.sorted_keys:
+            yield key.tobytes() if isinstance(key, void) else int(key)
+
+
+    def __len__(self):
+        return len(self.sorted_keys)
+
+
+class LSHPersistence:
+    """
+    The methods of LSH that save a fitted model, load it back and fit it out of core. They use the hash family, the band
+    tables and the band hashing methods of LSH (partition_into_bands, _bucket_key, _compact).
+    """
+
+    def save(self, path):
+        """
+        This method writes the fitted model to the directory path, created if needed. The parameters of the model and the
+        scalar parameters of the hash family go to meta.json. The arrays of the hash functions, the documents (in CSC form),
+        the signature matrix and, for every band, the sorted bucket keys, bucket offsets and document ids go to .npy files,
+        which load can memory map.
+        """
+        if not self.hash_tables:
+            raise ValueError("The model must be fitted before it is saved")
+
+        makedirs(path, exist_ok=True)
+
+        family = self.hash_mehod
+
+        columns = family.columns
+        if columns is not None:
+            for name in ('indptr', 'indices', 'values'):
+                save(join(path, f'columns_{name}.npy'), getattr(columns, name))
+
+        save(join(path, 'signatures.npy'), asarray(family.sign_matrix))
+
+        for i, hash_table in enumerate(self.hash_tables):
+            buckets = hash_table if isinstance(hash_table, SortedBuckets) else SortedBuckets.from_table(hash_table)
+
+            for name, value in (('keys', buckets.sorted_keys), ('offsets', buckets.offsets), ('ids', buckets.ids)):
+                save(join(path, f'band_{i}_{name}.npy'), value)
+
+        self._save_meta(path, documents=columns is not None)
+
+
+    def _save_meta(self, path, documents):
+        """
+        This method writes the parameters of the model and of its hash family to path: scalars (numpy scalars as their
+        python value) to meta.json, arrays (and the lists of permutations of MinHash) to .npy files. The rest of the family
+        is rebuilt by load. An attribute of the family that is none of these raises a ValueError, rather than being lost.
+        """
+        family = self.hash_mehod
+
+        def scalar(value):
+            return value.item() if isinstance(value, generic) else value
+
+        scalars, arrays = {}, []
+        for name, value in family.__dict__.items():
+            # the documents, and the random source MinHash drew its permutations from
+            if name in ('columns', 'sign_matrix', 'shuffle'):
+                continue
+            elif isinstance(value, (int, float, str, bool, generic)) or value is None:
+                scalars[name] = scalar(value)
+            elif isinstance(value, tuple):
+                scalars[name] = [scalar(v) for v in value]
+            elif isinstance(value, (ndarray, list)):
+                save(join(path, f'family_{name}.npy'), asarray(value))
+                arrays.append((name, isinstance(value, list)))
+            else:
+                raise ValueError(f"cannot save the attribute {name} of {type(family).__name__}, of type {type(value).__name__}")
+
+        meta = {
+            'nfuncs': self.nfuncs, 'bands': self.bands, 'num_buckets': self.num_buckets, 'seed': self.seed,
+            'family': [type(family).__module__, type(family).__qualname__],
+            'family_scalars': scalars, 'family_arrays': arrays, 'n_rows': family.shape[0], 'documents': documents,
+        }
+
+        with open(join(path, 'meta.json'), 'w') as f:
+            dump(meta, f, indent=2)
+
+
+    def fit_stream(self, chunks, path, num_buckets=None, n_rows=None, keep_data=True, block_size=1 << 16):
+        """
+        This method fits the model out of core, on an iterator of chunks of documents (each chunk any input accepted by
+        SparseColumns.from_data, e.g. the shingle-id sets of a block of rows read from a CSV file), and writes the index
+        to the directory path, in the format of save. Every chunk is signed with the hash family, its signatures (and its
+        documents, unless keep_data is False) are appended to raw files, and its (band, key, doc_id) records are sorted and
+        written to a run file. The runs are then merged with a k-way heap merge into the sorted bucket arrays of every band.
+        Memory stays bounded by the size of a chunk and block_size records per run, not by the size of the corpus.
+        n_rows is the size of the vocabulary. The vocabulary grows with the largest shingle id of every chunk, but the
+        families that draw a vector per row (fixed_vocabulary: SimHash, PStableHash) need it up front,
+        and raise a ValueError on a later chunk holding an id past the one of the first chunk when it is not given.
+        The model is loaded back from path, memory mapped.
+        """
+        assert self.nfuncs % self.bands == 0
+
+        makedirs(path, exist_ok=True)
+        runs_dir = join(path, 'runs')
+        makedirs(runs_dir, exist_ok=True)
+
+        self.num_buckets = num_buckets
+
+        chunks = iter(chunks)
+        first = next(chunks, None)
+        if first is None:
+            raise ValueError("fit_stream needs at least one chunk of documents")
+
+        first = SparseColumns.from_data(first, n_rows=n_rows)
+        vocab = first.shape[0] if n_rows is None else n_rows
+
+        # the hash functions, drawn without any document
+        self.hash_mehod = self.hash_family(SparseColumns(zeros(1, dtype=int64), empty(0, dtype=int64), empty(0), vocab), nfuncs=self.nfuncs, seed=self.seed)
+
+        names = ('signatures', 'columns_indptr', 'columns_indices', 'columns_values')
+        files = {name: open(join(path, f'{name}.raw'), 'wb') for name in names}
+
+        runs, n_docs, nnz, stored, values_dtype = [], 0, 0, None, first.values.dtype
+        try:
+            files['columns_indptr'].write(zeros(1, dtype=int64).tobytes())
+
+            for chunk in chain([first], chunks):
+                columns = SparseColumns.from_data(chunk, n_rows=vocab)
+                self.hash_mehod._check_vocabulary(columns)
+
+                signatures = self.hash_mehod.signatures(columns)
+                stored = self._compact(signatures)
+
+                # column after column, the layout of a Fortran ordered matrix
+                files['signatures'].write(ascontiguousarray(stored.T).tobytes())
+
+                if keep_data:
+                    files['columns_indptr'].write((columns.indptr[1:] + nnz).astype(int64).tobytes())
+                    files['columns_indices'].write(columns.indices.astype(int64).tobytes())
+                    files['columns_values'].write(columns.values.astype(values_dtype).tobytes())
+
+                runs.append(self._write_run(join(runs_dir, f'run_{len(runs)}.npy'), signatures, n_docs, empty_docs=diff(columns.indptr) == 0))
+
+                n_docs += len(columns)
+                nnz += len(columns.indices)
+                vocab = max(vocab, columns.shape[0])
+
+        finally:
+            for f in files.values():
+                f.close()
+
+        self.hash_mehod.shape = (vocab, n_docs)
+
+        _write_npy(join(path, 'signatures.npy'), join(path, 'signatures.raw'), stored.dtype, (stored.shape[0], n_docs), fortran_order=True)
+
+        for name, dt, shape in (('columns_indptr', int64, (n_docs + 1,)), ('columns_indices', int64, (nnz,)), ('columns_values', values_dtype, (nnz,))):
+            if keep_data:
+                _write_npy(join(path, f'{name}.npy'), join(path, f'{name}.raw'), dt, shape)
+            else:
+                remove(join(path, f'{name}.raw'))
+
+        self._merge_runs(runs, path, n_docs, block_size)
+
+        for run in runs:
+            remove(run)
+        rmdir(runs_dir)
+
+        self._save_meta(path, documents=keep_data)
+
+        loaded = type(self).load(path, mmap=True)
+        self.hash_mehod, self.hash_tables = loaded.hash_mehod, loaded.hash_tables
+
+        return self
+
+
+    def _write_run(self, run, sign_matrix, offset, empty_docs=None):
+        """
+        This method writes the (band, key, doc_id) records of a chunk of signatures to the run file run, sorted by band,
+        then key, then document id. The keys are the bytes of the band signatures in exact mode, bucket indices otherwise,
+        and the documents of the chunk take the ids from offset on. The empty documents are left out, as in _hash_bands.
+        """
+        ids = arange(sign_matrix.shape[1]) if empty_docs is None else flatnonzero(~asarray(empty_docs))
+        sign_matrix = sign_matrix[:, ids]
+
+        n_docs = sign_matrix.shape[1]
+        bands = self.partition_into_bands(sign_matrix)
+
+        if self.num_buckets is None:
+            key_dtype = dtype((void, sign_matrix.dtype.itemsize * bands.shape[1]))
+        else:
+            key_dtype = dtype(int64)
+
+        records = empty(self.bands * n_docs, dtype=[('band', int64), ('key', key_dtype), ('doc', int64)])
+
+        for b, band in enumerate(bands):
+            columns = ascontiguousarray(band.T)
+
+            if self.num_buckets is None:
+                keys = columns.view(key_dtype).ravel()
+            else:
+                keys = array([self._bucket_key(column) for column in columns], dtype=int64)
+
+            # stable, so the documents of a key stay in increasing order
+            order = argsort(keys, kind='stable')
+
+            records['band'][b*n_docs:(b+1)*n_docs] = b
+            records['key'][b*n_docs:(b+1)*n_docs] = keys[order]
+            records['doc'][b*n_docs:(b+1)*n_docs] = ids[order] + offset
+
+        save(run, records)
+
+        return run
+
+
+    def _merge_runs(self, runs, path, n_docs, block_size):
+        """
+        This method merges the sorted run files into the bucket arrays of every band (sorted keys, offsets and document
+        ids), written to path in the format of save. Each run is read block_size records at a time, and the records of a
+        band are written in blocks by a _BandWriter.
+        """
+        writer = None
+
+        for band, key, doc in merge(*(_run_records(run, block_size) for run in runs)):
+
+            if writer is None or writer.band != band:
+                if writer is not None:
+                    writer.close()
+                writer = _BandWriter(path, band, key, n_docs, block_size)
+
+            writer.add(key, doc)
+
+        writer.close()
+
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        This method reads a model written by save from the directory path. With mmap, the arrays are memory mapped read-only
+        instead of read into memory, so loading costs no time and processes that load the same index share its pages.
+        The band tables are SortedBuckets; partial_fit turns them back into in-memory tables.
+        """
+        mode = 'r' if mmap else None
+
+        with open(join(path, 'meta.json')) as f:
+            meta = load_json(f)
+
+        # rebuild the hash family without calling its constructor
+        module, name = meta['family']
+        family_class = getattr(import_module(module), name)
+
+        family = family_class.__new__(family_class)
+        family.__dict__.update(meta['family_scalars'])
+        if 'shape' in meta['family_scalars']:
+            family.shape = tuple(family.shape)
+
+        for name, is_list in meta['family_arrays']:
+            value = load(join(path, f'family_{name}.npy'), mmap_mode=mode)
+            setattr(family, name, value.tolist() if is_list else value)
+
+        family.columns = None
+        if meta['documents']:
+            family.columns = SparseColumns(*(load(join(path, f'columns_{name}.npy'), mmap_mode=mode) for name in ('indptr', 'indices', 'values')), meta['n_rows'])
+        family.sign_matrix = load(join(path, 'signatures.npy'), mmap_mode=mode)
+
+        lsh = cls(meta['nfuncs'], meta['bands'], hash_family=family_class, seed=meta['seed'])
+        lsh.num_buckets = meta['num_buckets']
+        lsh.hash_mehod = family
+        lsh.hash_tables = [SortedBuckets(*(load(join(path, f'band_{i}_{name}.npy'), mmap_mode=mode) for name in ('keys', 'offsets', 'ids')))
+                           for i in range(meta['bands'])]
+
+        return lsh
@@ -0,0 +1,217 @@
+from numpy import array, zeros, ones, arange, nonzero, searchsorted, minimum, concatenate, cumsum, asarray, int64
+from numpy import repeat, diff, bincount, intersect1d, sqrt, divide, float64, maximum
+from collections.abc import Mapping
+
+"""
+The SparseColumns class stores the documents column by column, in compressed sparse column (CSC) form: for every document
+the sorted indices of its nonzero rows (shingle ids) and their values. The hash families and LSH accept a dense one-hot
+matrix of shape (vocab, docs), a scipy CSR/CSC matrix, or an iterable of integer shingle-id sets, and convert it to
+SparseColumns, so that memory scales with the total number of shingles and not with vocab x docs.
+
+
+The SparseColumns class has the following methods and attributes:
+
+    from_data(cls, data, n_rows):
+        This class method converts the input documents (SparseColumns, a scipy sparse matrix, a dense (vocab, docs) matrix
+        or an iterable of shingle-id sets or of mappings of shingle id to weight) to SparseColumns.
+
+    append(self, data):
+        This method appends the documents of data as new columns, widening the vocabulary to the largest shingle id they hold.
+
+    column(self, j), take(self, cols):
+        These methods return a column as a dense vector, and the given columns as new SparseColumns.
+
+    norms(self), sums(self):
+        These methods return the euclidean norm and the sum of the values of every column, computed once and cached.
+
+    similarity(self, i, j, metric, chunk_size):
+        This method computes the cosine, jaccard, weighted_jaccard or euclidean similarity of the column pairs (i[k], j[k])
+        for all k at once, touching only the nonzeros.
+"""
+
+
+class SparseColumns:
+    """
+    Compressed sparse column storage of a set of documents. The nonzero row indices of column j are
+    indices[indptr[j]:indptr[j+1]], sorted, with their values at the same positions of values.
+    """
+
+    def __init__(self, indptr, indices, values, n_rows):
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values
+        self.shape = (n_rows, len(indptr) - 1)
+
+        # euclidean norms and sums of the columns, computed on first use
+        self._norms = None
+        self._sums = None
+
+
+    @classmethod
+    def from_data(cls, data, n_rows=None):
+        """
+        Converts the input documents to SparseColumns. Accepted inputs are SparseColumns (returned as is), scipy sparse
+        matrices of shape (vocab, docs), dense arrays of shape (vocab, docs), and iterables of integer shingle-id sets
+        (one per document), whose vocabulary size is n_rows, widened to the largest id plus one. A document can also be a
+        mapping of shingle id to weight, such as a collections.Counter of shingle counts.
+        """
+        if isinstance(data, cls):
+            return data
+
+        # scipy sparse matrices, without importing scipy
+        if hasattr(data, 'tocsc'):
+            csc = data.tocsc()
+            if not csc.has_sorted_indices:
+                csc = csc.sorted_indices()
+            return cls(asarray(csc.indptr, dtype=int64), asarray(csc.indices, dtype=int64), asarray(csc.data), csc.shape[0])
+
+        # dense (vocab, docs) matrices
+        if hasattr(data, 'ndim') and data.ndim == 2:
+            cols, rows = nonzero(data.T)
+            indptr = searchsorted(cols, arange(data.shape[1] + 1))
+            return cls(indptr, rows.astype(int64), data[rows, cols], data.shape[0])
+
+        # iterables of shingle-id sets, or of mappings of shingle id to weight (e.g. collections.Counter)
+        docs = [sorted(doc.items()) if isinstance(doc, Mapping) else [(i, 1) for i in sorted(set(doc))] for doc in data]
+
+        indptr = concatenate(([0], cumsum([len(doc) for doc in docs]))).astype(int64)
+        indices = array([i for doc in docs for i, _ in doc], dtype=int64)
+        values = array([w for doc in docs for _, w in doc]) if len(indices) else ones(0, dtype=int64)
+
+        # the vocabulary holds at least every id found
+        n_rows = max(n_rows or 0, int(indices.max()) + 1 if len(indices) else 0)
+
+        return cls(indptr, indices, values, n_rows)
+
+
+    def __len__(self):
+        return self.shape[1]
+
+
+    def append(self, data):
+        """
+        Appends the documents of data (any input accepted by from_data) as new columns, widening the vocabulary
+        to the largest shingle id they hold.
+        """
+        other = SparseColumns.from_data(data, n_rows=self.shape[0])
+
+        self.indptr = concatenate((self.indptr, other.indptr[1:] + self.indptr[-1]))
+        self.indices = concatenate((self.indices, other.indices))
+        self.values = concatenate((self.values, other.values))
+
+        # new documents may hold shingle ids past the vocabulary seen so far
+        n_rows = max(self.shape[0], other.shape[0], int(other.indices.max()) + 1 if len(other.indices) else 0)
+        self.shape = (n_rows, len(self.indptr) - 1)
+        self._norms = None
+        self._sums = None
+
+        return self
+
+
+    def column(self, j):
+        """
+        Returns column j as a dense vector of length vocab.
+        """
+        vector = zeros(self.shape[0], dtype=self.values.dtype)
+        lo, hi = self.indptr[j], self.indptr[j+1]
+        vector[self.indices[lo:hi]] = self.values[lo:hi]
+
+        return vector
+
+
+    def take(self, cols):
+        """
+        Returns the given columns, in the given order, as new SparseColumns.
+        """
+        cols = asarray(cols, dtype=int64)
+        positions, lengths = self._entries(cols)
+
+        indptr = concatenate(([0], cumsum(lengths))).astype(int64)
+
+        return SparseColumns(indptr, self.indices[positions], self.values[positions], self.shape[0])
+
+
+    def norms(self):
+        """
+        Returns the euclidean norm of every column, computed once and cached.
+        """
+        if self._norms is None:
+            cols = repeat(arange(len(self)), diff(self.indptr))
+            self._norms = sqrt(bincount(cols, weights=self.values.astype(float64) ** 2, minlength=len(self)))
+
+        return self._norms
+
+
+    def sums(self):
+        """
+        Returns the sum of the values of every column, computed once and cached.
+        """
+        if self._sums is None:
+            cols = repeat(arange(len(self)), diff(self.indptr))
+            self._sums = bincount(cols, weights=self.values.astype(float64), minlength=len(self))
+
+        return self._sums
+
+
+    def _entries(self, cols):
+        """
+        Returns the positions in indices/values of the entries of the given columns, one column after the other,
+        along with the number of entries of each column.
+        """
+        lengths = self.indptr[cols + 1] - self.indptr[cols]
+        starts = self.indptr[cols] - (cumsum(lengths) - lengths)
+
+        return repeat(starts, lengths) + arange(lengths.sum()), lengths
+
+
+    def similarity(self, i, j, metric='cosine', chunk_size=1 << 16):
+        """
+        Computes the similarity of the column pairs (i[k], j[k]) for all k at once. The entries of both sides of a chunk
+        of pairs are keyed by (pair, row) and intersected with a single sorted intersection, so only the nonzeros are
+        touched. The metric is 'cosine' (dot product over the cached norms), 'jaccard' (over the sets of nonzero rows),
+        'weighted_jaccard' (sum of the minima over sum of the maxima of the weights), or 'euclidean', reported as the
+        similarity 1 / (1 + distance). Unlike helpers.cosine_similarity the results are not rounded.
+        """
+        i, j = asarray(i, dtype=int64), asarray(j, dtype=int64)
+        sims = zeros(len(i), dtype=float64)
+
+        for lo in range(0, len(i), chunk_size):
+            ci, cj = i[lo:lo+chunk_size], j[lo:lo+chunk_size]
+            pairs = arange(len(ci))
+
+            pos_i, len_i = self._entries(ci)
+            pos_j, len_j = self._entries(cj)
+
+            # (pair, row) keys, sorted since rows are sorted within every column
+            keys_i = repeat(pairs, len_i) * self.shape[0] + self.indices[pos_i]
+            keys_j = repeat(pairs, len_j) * self.shape[0] + self.indices[pos_j]
+
+            common, at_i, at_j = intersect1d(keys_i, keys_j, assume_unique=True, return_indices=True)
+            common_pairs = common // max(1, self.shape[0])
+
+            if metric in ('cosine', 'euclidean'):
+                dots = bincount(common_pairs, weights=self.values[pos_i[at_i]] * self.values[pos_j[at_j]], minlength=len(ci))
+                norms_i, norms_j = self.norms()[ci], self.norms()[cj]
+
+            if metric == 'cosine':
+                denominator = norms_i * norms_j
+                divide(dots, denominator, out=sims[lo:lo+chunk_size], where=denominator > 0)
+
+            elif metric == 'euclidean':
+                distances = sqrt(maximum(norms_i ** 2 + norms_j ** 2 - 2 * dots, 0))
+                sims[lo:lo+chunk_size] = 1 / (1 + distances)
+
+            elif metric == 'jaccard':
+                intersection = bincount(common_pairs, minlength=len(ci)).astype(float64)
+                union = len_i + len_j - intersection
+                divide(intersection, union, out=sims[lo:lo+chunk_size], where=union > 0)
+
+            elif metric == 'weighted_jaccard':
+                minima = bincount(common_pairs, weights=minimum(self.values[pos_i[at_i]], self.values[pos_j[at_j]]), minlength=len(ci))
+                union = self.sums()[ci] + self.sums()[cj] - minima
+                divide(minima, union, out=sims[lo:lo+chunk_size], where=union > 0)
+
+            else:
+                raise ValueError(f"Unknown metric {metric}, expected 'cosine', 'jaccard', 'weighted_jaccard' or 'euclidean'")
+
+        return sims
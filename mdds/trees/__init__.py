@@ -1,4 +1,5 @@
+from .bplustree import BPlusTree
 from .kdtree import KDTree
 from .quadtree import QuadTree
-from .rangetree import RangeTree1D, RangeTree2D
+from .rangetree import RangeTree1D, ArrayRangeTree1D, RangeTree2D, LayeredRangeTree2D, CompactRangeTree2D, DynamicRangeTree2D, RangeTreeND
 from .rtree import RTree
\ No newline at end of file
@@ -0,0 +1,259 @@
+'''
+class BPlusTree: A balanced, ordered 1-dimensional index over the points, keyed on a single axis. The class has the following methods:
+
+    __init__(self, points, axis, order):
+        Initializes an empty tree, where every node holds at most order keys (leaves) or order children (internal nodes),
+        and inserts the given points.
+
+    insert(self, point):
+        Descends to the leaf that covers the key of the point and inserts it in sorted position. A node that overflows
+        is split in two halves and its separator moves up to the parent, so the tree grows only at the root and
+        all leaves stay at the same depth. Every insertion costs O(log n).
+
+    delete(self, point):
+        Removes the point from its leaf. A node that underflows borrows an entry from a sibling or gets merged with it,
+        which keeps the tree balanced under any sequence of updates, including sorted ones.
+
+    update(self, point, new_point):
+        Replaces a point with another one, which may have a different key.
+
+    query(self, range):
+        Finds the first leaf of the range with one descent, then walks the leaf links until the upper bound of the range,
+        without recursing into the tree. It costs O(log n + k) for k reported points.
+'''
+
+from bisect import bisect_left, bisect_right
+from mdds.trees.nodes import BPlusNode
+class BPlusTree:
+
+    def __init__(self, points=None, axis=0, order=32):
+        """
+            Initializes the B+-tree and inserts the given points.
+
+            Parameters:
+            - points (List[Tuple[int, int]]): An optional list of points to insert.
+            - axis (int): The dimension of the points used as key (default: 0).
+            - order (int): The maximum number of keys of a leaf and of children of an internal node (default: 32).
+        """
+        if order < 3:
+            raise ValueError("The order of a B+-tree must be at least 3")
+
+        self.axis = axis
+        self.order = order
+        self.root = BPlusNode(leaf=True)
+        self.size = 0
+
+        for point in points or []:
+            self.insert(point)
+
+
+    def __len__(self):
+        return self.size
+
+
+    def _min_entries(self, node):
+        """ The minimum number of keys of a leaf, or of children of an internal node, below which it underflows. """
+        return self.order // 2 if node.leaf else (self.order + 1) // 2
+
+
+    def _entries(self, node):
+        return len(node.keys) if node.leaf else len(node.children)
+
+
+    def insert(self, point):
+        """
+            Inserts a point in the tree. If the root splits, a new root is created on top of the two halves.
+        """
+        split = self._insert(self.root, point[self.axis], point)
+
+        if split:
+            separator, right = split
+            root = BPlusNode(leaf=False)
+            root.keys = [separator]
+            root.children = [self.root, right]
+            self.root = root
+
+        self.size += 1
+
+
+    def _insert(self, node, key, point):
+        """
+            Inserts the point in the subtree of node. Returns the separator and the new right sibling if node split,
+            otherwise None.
+        """
+        if node.leaf:
+            i = bisect_right(node.keys, key)
+            node.keys.insert(i, key)
+            node.values.insert(i, point)
+
+            if len(node.keys) <= self.order: return None
+
+            # split the leaf in two halves and link them
+            median = len(node.keys) // 2
+            right = BPlusNode(leaf=True)
+            right.keys, node.keys = node.keys[median:], node.keys[:median]
+            right.values, node.values = node.values[median:], node.values[:median]
+            right.next, node.next = node.next, right
+
+            return right.keys[0], right
+
+        i = bisect_right(node.keys, key)
+        split = self._insert(node.children[i], key, point)
+
+        if not split: return None
+
+        separator, child = split
+        node.keys.insert(i, separator)
+        node.children.insert(i+1, child)
+
+        if len(node.children) <= self.order: return None
+
+        # split the internal node, the median key moves up
+        median = len(node.keys) // 2
+        right = BPlusNode(leaf=False)
+        separator = node.keys[median]
+        right.keys, node.keys = node.keys[median+1:], node.keys[:median]
+        right.children, node.children = node.children[median+1:], node.children[:median+1]
+
+        return separator, right
+
+
+    def delete(self, point):
+        """
+            Deletes a point from the tree, rebalancing the nodes on the way back up.
+
+            Returns:
+            - bool: True if the point was found and deleted.
+        """
+        deleted = self._delete(self.root, point[self.axis], point)
+
+        # shrink the tree when the root is left with a single child
+        if not self.root.leaf and len(self.root.children) == 1:
+            self.root = self.root.children[0]
+
+        if deleted: self.size -= 1
+
+        return deleted
+
+
+    def _delete(self, node, key, point):
+        """
+            Deletes the point from the subtree of node. Equal keys may span several subtrees,
+            so all the children that can hold the key are tried in order.
+        """
+        if node.leaf:
+            for i in range(bisect_left(node.keys, key), bisect_right(node.keys, key)):
+                if node.values[i] == point:
+                    del node.keys[i]
+                    del node.values[i]
+                    return True
+            return False
+
+        for i in range(bisect_left(node.keys, key), bisect_right(node.keys, key) + 1):
+            child = node.children[i]
+            if self._delete(child, key, point):
+                if self._entries(child) < self._min_entries(child):
+                    self._rebalance(node, i)
+                return True
+
+        return False
+
+
+    def _rebalance(self, node, i):
+        """
+            Fixes the underflow of node.children[i], by borrowing an entry from a sibling that can spare one,
+            or else by merging it with a sibling.
+        """
+        child = node.children[i]
+        left = node.children[i-1] if i > 0 else None
+        right = node.children[i+1] if i + 1 < len(node.children) else None
+
+        if left and self._entries(left) > self._min_entries(left):
+            if child.leaf:
+                child.keys.insert(0, left.keys.pop())
+                child.values.insert(0, left.values.pop())
+                node.keys[i-1] = child.keys[0]
+            else:
+                child.keys.insert(0, node.keys[i-1])
+                child.children.insert(0, left.children.pop())
+                node.keys[i-1] = left.keys.pop()
+
+        elif right and self._entries(right) > self._min_entries(right):
+            if child.leaf:
+                child.keys.append(right.keys.pop(0))
+                child.values.append(right.values.pop(0))
+                node.keys[i] = right.keys[0]
+            else:
+                child.keys.append(node.keys[i])
+                child.children.append(right.children.pop(0))
+                node.keys[i] = right.keys.pop(0)
+
+        elif left:
+            self._merge(node, i-1)
+
+        elif right:
+            self._merge(node, i)
+
+
+    def _merge(self, node, i):
+        """ Merges node.children[i+1] into node.children[i] and drops their separator from node. """
+        left, right = node.children[i], node.children[i+1]
+
+        if left.leaf:
+            left.keys += right.keys
+            left.values += right.values
+            left.next = right.next
+        else:
+            left.keys += [node.keys[i]] + right.keys
+            left.children += right.children
+
+        del node.keys[i]
+        del node.children[i+1]
+
+
+    def update(self, point, new_point):
+        """ Replaces point with new_point, moving it to the position of its new key. """
+        if self.delete(point):
+            self.insert(new_point)
+
+
+    def query(self, range):
+        """
+            Returns all the points whose key lies within range, ordered by key.
+            A single descent finds the leaf of the lower bound, and the scan then follows the leaf links.
+
+            Parameters:
+            - range (Tuple[int, int]): A tuple in the form (min, max), both bounds inclusive.
+        """
+        low, high = range
+
+        node = self.root
+        while not node.leaf:
+            node = node.children[bisect_left(node.keys, low)]
+
+        values = []
+        i = bisect_left(node.keys, low)
+
+        while node:
+            while i < len(node.keys):
+                if node.keys[i] > high: return values
+                values.append(node.values[i])
+                i += 1
+            node, i = node.next, 0
+
+        return values
+
+
+    def print_tree(self):
+        self._print_tree(self.root, 0)
+
+
+    def _print_tree(self, node, depth):
+        if node.leaf:
+            print("  " * depth + "-> " + str([str(value) for value in node.values]))
+            return
+
+        for i, child in enumerate(node.children):
+            self._print_tree(child, depth + 1)
+            if i < len(node.keys):
+                print("  " * depth + "-- " + str(node.keys[i]))
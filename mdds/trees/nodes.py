@@ -15,6 +15,48 @@ class Node:
         self.y_tree = y_tree
 
 
+class LayeredNode:
+    '''
+        Represents a node in the layered (fractional cascading) range tree.
+        Each node has the following attributes:
+            - left: the left child node of the current node
+            - right: the right child node of the current node
+            - key: the largest x-coordinate stored in the left subtree (the point itself on leaves)
+            - points: the points of the subtree sorted by their y-coordinate
+            - ys: the y-coordinates of points, kept as a plain sorted list for binary search
+            - left_bridge: for every position i of ys, the first position in left.ys holding a value >= ys[i]
+            - right_bridge: for every position i of ys, the first position in right.ys holding a value >= ys[i]
+        Both bridge lists carry an extra trailing entry pointing past the end of the child's list.
+    '''
+
+    def __init__(self, left=None, right=None, key=None, points=None, ys=None, left_bridge=None, right_bridge=None):
+        self.left = left
+        self.right = right
+        self.key = key
+        self.points = points
+        self.ys = ys
+        self.left_bridge = left_bridge
+        self.right_bridge = right_bridge
+
+
+class BPlusNode:
+    '''
+        Represents a node in the B+-tree.
+        Each node has the following attributes:
+            - keys: the sorted keys of the node. On internal nodes they separate the subtrees of children
+            - children: the child nodes of an internal node, always one more than its keys
+            - values: the points of a leaf node, aligned with its keys
+            - next: the leaf that follows a leaf node in key order, linking all the leaves into a list
+    '''
+
+    def __init__(self, leaf=True):
+        self.keys = []
+        self.children = []
+        self.values = []
+        self.next = None
+        self.leaf = leaf
+
+
 """
 class Node:
     class Node: Represents a node in the KD-Tree. Each node has a left child, right child, and a value.
@@ -16,8 +16,86 @@
                 x_range: Represents the range of x-coord. Could be any iterable containing 2 numbers
                 y_range: Represents the range of y-coord. Could be any iterable containing 2 numbers
 
+    LayeredRangeTree2D is a variant of the 2D range tree that replaces the associated 1D trees with y-sorted lists
+    connected through bridge pointers (fractional cascading). A query performs a single binary search on the y-list of
+    the root and then follows the bridges downwards in O(1) per level, so it costs O(log n + k) for k reported points.
+
+    ArrayRangeTree1D is an array-backed replacement of RangeTree1D. It keeps one sorted key array plus the permutation
+    that sorts the points, so a query costs two binary searches and a slice. It is the associated structure of every
+    RangeTree2D node.
+
+    CompactRangeTree2D stores the same canonical decomposition without any per-node objects. The coordinates are kept
+    once in NumPy arrays and the associated structures are int32 arrays of y-ranks, one array per tree depth.
+
+    DynamicRangeTree2D makes the static range trees semi-dynamic with the logarithmic method. Inserted points go to a
+    small buffer, which is merged into a list of static CompactRangeTree2D of geometrically growing sizes once it fills up.
+
+    RangeTreeND generalizes the range tree to any number of dimensions by recursively nesting associated structures.
+    The last dimension is indexed with ArrayRangeTree1D and the last two with LayeredRangeTree2D, so a query costs
+    O(log^(d-1) n + k).
+
 '''
-from mdds.trees.nodes import Node
+from bisect import bisect_left
+from sys import getsizeof
+from numpy import array, argsort, asarray, searchsorted, cumsum, concatenate, empty, arange, zeros, full, where, flatnonzero
+from numpy import sort, int32, int64
+from mdds.trees.nodes import Node, LayeredNode
+
+
+def _split_paths(node, low, high, key, left, right):
+    """
+        Walks a binary search tree over the range [low, high], the path walk shared by the range trees. It descends from node
+        to the split node, where the paths to low and high diverge, and then follows both paths down. Every subtree hanging
+        between the two paths lies entirely inside the range, so the range splits into O(log n) canonical subtrees.
+
+        Parameters:
+        - node: The root of the tree, or None.
+        - key (Callable): Returns the search key of a node: its own value, or the largest key of its left subtree.
+        - left, right (Callable): Return the children of a node, None when missing.
+
+        Yields:
+        - (node, True) for every canonical subtree, and (node, False) for the split node and the nodes of both paths
+          whose key lies within the range. On trees storing the points on their leaves, only the leaves of the latter
+          hold a point.
+    """
+    # find the split node
+    while node is not None:
+        node_key = key(node)
+        if high < node_key:
+            node = left(node)
+        elif low > node_key:
+            node = right(node)
+        else:
+            break
+    else:
+        return
+
+    yield node, False
+    split = node
+
+    # path to low, every right subtree hanging off it is inside the range
+    node = left(split)
+    while node is not None:
+        subtree = right(node)
+        if low <= key(node):
+            yield node, False
+            if subtree is not None: yield subtree, True
+            node = left(node)
+        else:
+            node = subtree
+
+    # path to high, every left subtree hanging off it is inside the range
+    node = right(split)
+    while node is not None:
+        subtree = left(node)
+        if high >= key(node):
+            yield node, False
+            if subtree is not None: yield subtree, True
+            node = right(node)
+        else:
+            node = subtree
+
+
 class RangeTree1D:
     """
         RangeTree1D is a class that represents a 1-dimensional range tree.
@@ -160,12 +238,143 @@ class RangeTree1D:
 
 
 
+class ArrayRangeTree1D:
+    """
+        ArrayRangeTree1D is an array-backed 1-dimensional range index.
+        Instead of a tree of nested objects it stores the keys of the points along a single axis in one sorted array,
+        together with the permutation (order) that maps every sorted position back to its point.
+        The points inside a range occupy a contiguous slice of the sorted array, which is located with two binary searches.
+    """
+    def __init__(self, points, axis=0):
+        """
+         The init method is the constructor for the class and takes two inputs:
+                points: A list of points in 2D space represented as tuple of x, y coordinates
+                axis: decides on which dimension to sort
+        """
+        self.axis = axis
+        self.points = list(points)
+
+        keys = array([point[axis] for point in self.points])
+
+        # stable sort keeps points with equal keys in input order
+        self.order = argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+        # prefix sums over the sorted points, built lazily per aggregated key
+        self._prefix_sums = {}
+
+
+    @classmethod
+    def from_sorted(cls, points, order, keys, axis=0):
+        """
+            Creates the index from data that is already sorted, skipping the sort of the constructor.
+            The points list is shared, not copied, so many indexes can refer to the same list.
+
+            Parameters:
+            - points (List[Tuple[int, int]]): The list of points that order refers to.
+            - order (numpy.ndarray): The positions in points, sorted by key.
+            - keys (numpy.ndarray): The sorted keys, aligned with order.
+            - axis (int): The dimension the keys were taken from.
+        """
+        tree = cls.__new__(cls)
+        tree.axis = axis
+        tree.points = points
+        tree.order = order
+        tree.keys = keys
+        tree._prefix_sums = {}
+
+        return tree
+
+
+    def __len__(self):
+        return len(self.order)
+
+
+    def _bounds(self, range):
+        """ Returns the slice [lo, hi) of the sorted keys that falls within the given range. """
+        lo = searchsorted(self.keys, range[0], side='left')
+        hi = searchsorted(self.keys, range[1], side='right')
+        return lo, hi
+
+
+    def query(self, range):
+        """
+            Returns all the points whose key lies within range, ordered by key.
+
+            Parameters:
+            - range (Tuple[int, int]): A tuple in the form (min, max), both bounds inclusive.
+        """
+        if not self.points: return []
+
+        lo, hi = self._bounds(range)
+
+        return [self.points[i] for i in self.order[lo:hi]]
+
+
+    def query_many(self, ranges):
+        """
+            Answers a batch of range queries with two vectorized binary searches over all of them.
+
+            Parameters:
+            - ranges (Iterable[Tuple[int, int]]): The (min, max) ranges to query.
+
+            Returns:
+            - List[List]: The points that fall within each range, in the same order as ranges.
+        """
+        ranges = asarray(ranges).reshape(-1, 2)
+
+        if not self.points: return [[] for _ in range(len(ranges))]
+
+        lows = searchsorted(self.keys, ranges[:, 0], side='left')
+        highs = searchsorted(self.keys, ranges[:, 1], side='right')
+
+        return [[self.points[i] for i in self.order[lo:hi]] for lo, hi in zip(lows, highs)]
+
+
+    def count(self, range):
+        """ Returns the number of points whose key lies within range, without materializing them. """
+        if not self.points: return 0
+
+        lo, hi = self._bounds(range)
+
+        return int(hi - lo)
+
+
+    def sum(self, range, key):
+        """
+            Returns the sum of key over the points whose key lies within range, using a prefix-sum array.
+            The prefix sums of a key are computed on its first use and cached, so repeated aggregates cost
+            two binary searches each.
+
+            Parameters:
+            - range (Tuple[int, int]): A tuple in the form (min, max), both bounds inclusive.
+            - key (int or Callable): The index of the aggregated coordinate, or a function mapping a point to a number.
+        """
+        if not self.points: return 0
+
+        if key not in self._prefix_sums:
+            value = key if callable(key) else (lambda point: point[key])
+            values = array([value(self.points[i]) for i in self.order])
+            self._prefix_sums[key] = concatenate(([0], cumsum(values)))
+
+        prefix = self._prefix_sums[key]
+        lo, hi = self._bounds(range)
+
+        return prefix[hi] - prefix[lo]
+
+
+    def print_tree(self):
+        for i in self.order:
+            print("-> " + str(self.points[i]))
+
+
+
 class RangeTree2D:
     """
         A 2D range tree implementation that allows for efficient range searches in two dimensions.
         The tree is constructed using a modified form of the k-d tree algorithm, where each
         node in the tree represents a split in the data along one of the two dimensions.
-        Additionally, each node also contains a 1D range tree of the data points that fall within its
+        Additionally, each node also contains a 1D array range index (ArrayRangeTree1D) of the data points that fall within its
         region, to allow for efficient searches along the other dimension.
     """
 
@@ -183,11 +392,25 @@ class RangeTree2D:
         self.root = self._build_tree(points)
 
 
+    @classmethod
+    def _from_node(cls, node, axis):
+        """ Wraps an already built subtree root into a RangeTree2D, the same way the children of every node are stored. """
+        tree = cls.__new__(cls)
+        tree.axis = axis
+        tree.root = node
+
+        return tree
+
+
     def _build_tree(self, points):
         """
-            Builds the 2D range tree recursively by dividing the input points into left and right subsets,
+            Builds the 2D range tree by dividing the input points into left and right subsets,
             according to the median of the x-coordinates of the points.
 
+            The points are sorted by x and ranked by y only once. The y-ordered associated array of every node is then
+            produced bottom-up, by merging the y-rank arrays of its children, so the whole build costs O(n log n).
+            All associated structures share the single x-sorted list of points and only own index arrays.
+
             This method is called during initialization and should not be called directly.
             
             Parameters:
@@ -200,21 +423,71 @@ class RangeTree2D:
         if not points:
             return None
 
-        if len(points) == 1:
-            return Node(value=points[0], y_tree=RangeTree1D(points, axis=1))
+        # sort by x coord once, the input list is left untouched
+        points = sorted(points, key=lambda point: point[self.axis])
+        n = len(points)
 
-        # sort by x coord
-        points.sort(key=lambda point: point[self.axis])
-        
-        median = len(points) // 2
+        # rank by y coord once
+        ys = array([point[1] for point in points])
+        y_rank = empty(n, dtype=int)
+        y_rank[argsort(ys, kind='stable')] = arange(n)
+
+        # top-down, find the node that every point belongs to at each depth,
+        # identified by the start of its x-range (-1 once the point has been used as a median)
+        position = arange(n)
+        lo, hi = zeros(n, dtype=int), full(n, n)
+        active = position < n
+        node_lo, medians = [], []
+
+        while active.any():
+            node_lo.append(where(active, lo, -1))
+            median = lo + (hi - lo) // 2
+            medians.append(flatnonzero(active & (position == median)))
+
+            left, right = active & (position < median), active & (position > median)
+            hi = where(left, median, hi)
+            lo = where(right, median + 1, lo)
+            active = left | right
+
+        # bottom-up, every node's y-ordered array is the merge of its children's arrays and its median.
+        # The arrays of one depth are stored side by side, so that the node spanning points[lo:hi] owns level[lo:hi]
+        levels, level_keys = [None] * len(node_lo), [None] * len(node_lo)
+        below = medians[-1][:0]
+
+        for depth in reversed(range(len(node_lo))):
+            merged = concatenate((below, medians[depth]))
+
+            # stable sort of sorted runs, which merges them
+            starts = node_lo[depth][merged]
+            below = merged[argsort(starts * n + y_rank[merged], kind='stable')]
+
+            starts = node_lo[depth][below]
+            level = zeros(n, dtype=int)
+            level[starts + arange(len(below)) - searchsorted(starts, starts)] = below
+
+            levels[depth] = level
+            level_keys[depth] = ys[level]
+
+        return self._build_range(points, levels, level_keys, 0, n, 0)
 
-        left_points = points[:median]
-        right_points = points[median+1:]
 
-        left = RangeTree2D(left_points) if left_points else None
-        right = RangeTree2D(right_points) if right_points else None
+    def _build_range(self, points, levels, level_keys, lo, hi, depth):
+        """
+            Creates the nodes of the subtree over the x-sorted points[lo:hi] at the given depth.
+            The associated structure of every node is a view on the merged arrays of its depth, so no sorting
+            or copying happens here.
+        """
+        median = lo + (hi - lo) // 2
+
+        left = self._build_range(points, levels, level_keys, lo, median, depth+1) if lo < median else None
+        right = self._build_range(points, levels, level_keys, median+1, hi, depth+1) if median+1 < hi else None
 
-        return Node(left=left, right=right, value=points[median], y_tree=RangeTree1D(points, axis=1))
+        return Node(
+            left=RangeTree2D._from_node(left, self.axis) if left else None,
+            right=RangeTree2D._from_node(right, self.axis) if right else None,
+            value=points[median],
+            y_tree=ArrayRangeTree1D.from_sorted(points, levels[depth][lo:hi], level_keys[depth][lo:hi], axis=1)
+        )
 
 
     def range_search(self, x_range, y_range):
@@ -249,6 +522,99 @@ class RangeTree2D:
         return values
 
 
+    def _canonical(self, x_range):
+        """
+            Decomposes the x-range into O(log n) canonical subsets. Starting from the split node, the paths to both
+            ends of the x-range are followed, and every subtree hanging between them lies entirely inside the x-range.
+
+            Returns:
+            - List[ArrayRangeTree1D]: The associated structures of the canonical subtrees.
+            - List[Tuple[int, int]]: The points stored on the nodes of the search paths that fall within the x-range.
+        """
+        trees, points = [], []
+
+        for node, inside in _split_paths(self.root, x_range[0], x_range[1], key=lambda node: node.value[self.axis],
+                                         left=lambda node: node.left.root if node.left else None,
+                                         right=lambda node: node.right.root if node.right else None):
+            if inside:
+                trees.append(node.y_tree)
+            else:
+                points.append(node.value)
+
+        return trees, points
+
+
+    def range_count(self, x_range, y_range):
+        """
+            Counts the points that fall within the given x-range and y-range without materializing them.
+            The x-range is decomposed into O(log n) canonical subtrees, and each one is counted with two binary searches
+            on its associated structure, for a total cost of O(log^2 n).
+
+            Parameters:
+            - x_range (Tuple[int, int]): A tuple representing the x-range of the query, in the form (x_min, x_max).
+            - y_range (Tuple[int, int]): A tuple representing the y-range of the query, in the form (y_min, y_max).
+
+            Returns:
+            - int: The number of points within the given ranges.
+        """
+        trees, points = self._canonical(x_range)
+
+        return sum(y_tree.count(y_range) for y_tree in trees) + \
+               sum(1 for point in points if y_range[0] <= point[1] <= y_range[1])
+
+
+    def range_sum(self, x_range, y_range, key):
+        """
+            Sums key over the points that fall within the given x-range and y-range without materializing them.
+            Works like range_count, but reads prefix-sum arrays of the canonical associated structures.
+
+            Parameters:
+            - x_range (Tuple[int, int]): A tuple representing the x-range of the query, in the form (x_min, x_max).
+            - y_range (Tuple[int, int]): A tuple representing the y-range of the query, in the form (y_min, y_max).
+            - key (int or Callable): The index of the aggregated coordinate, or a function mapping a point to a number.
+              Pass the same object across queries, prefix sums are cached per key.
+
+            Returns:
+            - The sum of key over the points within the given ranges.
+        """
+        trees, points = self._canonical(x_range)
+
+        value = key if callable(key) else (lambda point: point[key])
+
+        return sum(y_tree.sum(y_range, key) for y_tree in trees) + \
+               sum(value(point) for point in points if y_range[0] <= point[1] <= y_range[1])
+
+
+    def memory_usage(self):
+        """
+            Reports the memory held by the tree, in bytes. Points themselves are shared with the caller and are not counted.
+
+            Returns:
+            - dict: 'objects' for the Python objects of the tree (nodes, subtrees, associated structures and the points list),
+            'arrays' for the data of the NumPy arrays, and their 'total'.
+        """
+        if self.root is None:
+            return {'objects': getsizeof(self), 'arrays': 0, 'total': getsizeof(self)}
+
+        objects = getsizeof(self.root.y_tree.points)
+        arrays = 0
+
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            node, y_tree = tree.root, tree.root.y_tree
+
+            for obj in (tree, node, y_tree):
+                objects += getsizeof(obj) + getsizeof(vars(obj))
+
+            objects += getsizeof(y_tree.order) + getsizeof(y_tree.keys) - y_tree.order.nbytes - y_tree.keys.nbytes
+            arrays += y_tree.order.nbytes + y_tree.keys.nbytes
+
+            stack += [child for child in (node.left, node.right) if child]
+
+        return {'objects': objects, 'arrays': arrays, 'total': objects + arrays}
+
+
     def print_tree(self):
         self._print_tree(self.root, 0)
 
@@ -265,5 +631,470 @@ class RangeTree2D:
 
 
 
+class LayeredRangeTree2D:
+    """
+        A layered 2D range tree that uses fractional cascading to answer orthogonal range queries in O(log n + k) time.
+        The primary tree is a balanced binary tree over the x-sorted points, with the points stored on the leaves.
+        Every node keeps the points of its subtree sorted by y, together with two bridge lists that map each position
+        of its y-list to the first position of equal or greater y-value in the y-list of each child.
+    """
+
+    def __init__(self, points, axes=(0, 1)):
+        """
+            Initializes the layered range tree with the given list of points.
+
+            Parameters:
+            - points (List[Tuple[int, int]]): A list of points indexable by the two axes.
+            - axes (Tuple[int, int]): The point indices used as the x and y dimension (default: (0, 1)).
+        """
+
+        self.axes = tuple(axes)
+
+        # sort by x coord once, the input list is left untouched
+        points = sorted(points, key=lambda point: point[self.axes[0]])
+
+        self.root = self._build_tree(points, 0, len(points)) if points else None
+
+
+    def _bridge(self, ys, child_ys):
+        """
+            Computes for every value of ys the first position in child_ys holding a value >= to it.
+            Both lists are sorted, so a single linear sweep is enough. A trailing entry equal to len(child_ys) is
+            appended so that a search position past the end of ys maps past the end of child_ys.
+        """
+        bridge = []
+        j = 0
+        for y in ys:
+            while j < len(child_ys) and child_ys[j] < y:
+                j += 1
+            bridge.append(j)
+
+        bridge.append(len(child_ys))
+
+        return bridge
+
+
+    def _build_tree(self, points, lo, hi):
+        """
+            Builds the subtree over the x-sorted points[lo:hi] bottom-up. The y-list of an internal node is produced by
+            merging the y-lists of its children, so the whole construction costs O(n log n).
+
+            Returns:
+            - LayeredNode: The root node of the subtree.
+        """
+        x_axis, y_axis = self.axes
+
+        if hi - lo == 1:
+            point = points[lo]
+            return LayeredNode(key=point[x_axis], points=[point], ys=[point[y_axis]])
+
+        median = (lo + hi) // 2
+
+        left = self._build_tree(points, lo, median)
+        right = self._build_tree(points, median, hi)
+
+        # merge the y-sorted lists of the children
+        merged, ys = [], []
+        i = j = 0
+        while i < len(left.ys) or j < len(right.ys):
+            if j == len(right.ys) or (i < len(left.ys) and left.ys[i] <= right.ys[j]):
+                merged.append(left.points[i])
+                ys.append(left.ys[i])
+                i += 1
+            else:
+                merged.append(right.points[j])
+                ys.append(right.ys[j])
+                j += 1
+
+        return LayeredNode(
+            left=left,
+            right=right,
+            key=points[median-1][x_axis],
+            points=merged,
+            ys=ys,
+            left_bridge=self._bridge(ys, left.ys),
+            right_bridge=self._bridge(ys, right.ys)
+        )
 
 
+    def _report(self, node, pos, y_max, values):
+        """ Appends the points of node's y-list starting at pos while their y-coordinate does not exceed y_max. """
+        while pos < len(node.ys) and node.ys[pos] <= y_max:
+            values.append(node.points[pos])
+            pos += 1
+
+
+    def _in_range(self, point, x_range, y_range):
+        x_axis, y_axis = self.axes
+        return x_range[0] <= point[x_axis] <= x_range[1] and y_range[0] <= point[y_axis] <= y_range[1]
+
+
+    def range_search(self, x_range, y_range):
+        """
+            Performs a range search on the layered range tree, returning all points that fall within the given x-range and y-range.
+            The position of the lower y-bound is located with one binary search on the root, and is then carried down
+            the search paths through the bridge lists. Every subtree hanging entirely inside the x-range (a canonical subset)
+            reports its points straight from its y-list.
+
+            Parameters:
+            - x_range (Tuple[int, int]): A tuple representing the x-range of the query, in the form (x_min, x_max).
+            - y_range (Tuple[int, int]): A tuple representing the y-range of the query, in the form (y_min, y_max).
+
+            Returns:
+            - List[Tuple[int, int]]: A list of the points in the tree that fall within the given x-range and y-range.
+        """
+        if self.root is None: return []
+
+        values = []
+
+        # the nodes are walked along with the position of y_min in their y-list, carried down through the bridges
+        root = (self.root, bisect_left(self.root.ys, y_range[0]))
+
+        for (node, pos), inside in _split_paths(root, x_range[0], x_range[1], key=lambda state: state[0].key,
+                                                left=lambda state: (state[0].left, state[0].left_bridge[state[1]]) if state[0].left else None,
+                                                right=lambda state: (state[0].right, state[0].right_bridge[state[1]]) if state[0].right else None):
+            if inside:
+                self._report(node, pos, y_range[1], values)
+            elif node.left is None and self._in_range(node.points[0], x_range, y_range):
+                values.append(node.points[0])
+
+        return values
+
+
+
+class CompactRangeTree2D:
+    """
+        A 2D range tree with a compact, index-based storage layout.
+        The x and y coordinates are stored once, in NumPy arrays sorted along each axis. The primary tree is implicit:
+        the node spanning the x-sorted positions [lo, hi) splits at (lo + hi) // 2, down to single positions.
+        The associated structure of a node is the int32 slice levels[depth][lo:hi], which holds the y-ranks of its points
+        in increasing order. A query thus touches only O(log n) slices with two binary searches each.
+    """
+
+    def __init__(self, points, axes=(0, 1)):
+        """
+            Initializes the compact range tree with the given list of points.
+
+            Parameters:
+            - points (List[Tuple[int, int]]): A list of points indexable by the two axes.
+            - axes (Tuple[int, int]): The point indices used as the x and y dimension (default: (0, 1)).
+        """
+        self.axes = tuple(axes)
+        self.points = list(points)
+
+        n = len(self.points)
+        xs = array([point[self.axes[0]] for point in self.points])
+        ys = array([point[self.axes[1]] for point in self.points])
+
+        # coordinates sorted once per axis, with the permutations back to the points
+        self.x_order = argsort(xs, kind='stable').astype(int32)
+        self.y_order = argsort(ys, kind='stable').astype(int32)
+        self.xs = xs[self.x_order]
+        self.ys = ys[self.y_order]
+
+        # y-rank of every x-sorted position
+        y_rank = empty(n, dtype=int64)
+        y_rank[self.y_order] = arange(n)
+        y_rank = y_rank[self.x_order]
+
+        # top-down, the start of the node that every position belongs to at each depth, down to single positions
+        position = arange(n)
+        lo, hi = zeros(n, dtype=int64), full(n, n, dtype=int64)
+        node_lo = []
+
+        while n:
+            node_lo.append(lo)
+
+            if (hi - lo <= 1).all(): break
+
+            median = (lo + hi) // 2
+            left = position < median
+            hi = where(left, median, hi)
+            lo = where(left, lo, median)
+
+        # bottom-up, the ranks of a node are the merge of the sorted ranks of its two children, which lie side by side,
+        # so a stable sort of the runs merges them in linear time per depth and the build costs O(n log n)
+        self.levels = [None] * len(node_lo)
+        below = y_rank
+
+        for depth in reversed(range(len(node_lo))):
+            below = sort(node_lo[depth] * n + below, kind='stable') % n
+            self.levels[depth] = below.astype(int32)
+
+
+    def __len__(self):
+        return len(self.points)
+
+
+    def _canonical(self, x_range):
+        """
+            Decomposes the x-sorted positions within x_range into O(log n) canonical nodes.
+
+            Returns:
+            - List[Tuple[int, int, int]]: The (lo, hi, depth) of every canonical node.
+        """
+        x_lo = searchsorted(self.xs, x_range[0], side='left')
+        x_hi = searchsorted(self.xs, x_range[1], side='right')
+
+        nodes = []
+        if x_lo >= x_hi: return nodes
+
+        # the nodes of the implicit tree are (lo, hi, depth), keyed by the last position of their left half,
+        # or by their single position on leaves
+        for (lo, hi, depth), inside in _split_paths((0, len(self.points), 0), x_lo, x_hi - 1,
+                                                    key=lambda node: max(node[0], (node[0] + node[1]) // 2 - 1),
+                                                    left=lambda node: (node[0], (node[0] + node[1]) // 2, node[2] + 1) if node[1] - node[0] > 1 else None,
+                                                    right=lambda node: ((node[0] + node[1]) // 2, node[1], node[2] + 1) if node[1] - node[0] > 1 else None):
+            if inside or hi - lo == 1:
+                nodes.append((lo, hi, depth))
+
+        return nodes
+
+
+    def _rank_slices(self, x_range, y_range):
+        """ Yields the rank slice of every canonical node restricted to y_range, along with its bounds. """
+        y_lo = searchsorted(self.ys, y_range[0], side='left')
+        y_hi = searchsorted(self.ys, y_range[1], side='right')
+
+        for lo, hi, depth in self._canonical(x_range):
+            ranks = self.levels[depth][lo:hi]
+            yield ranks, searchsorted(ranks, y_lo, side='left'), searchsorted(ranks, y_hi, side='left')
+
+
+    def range_indices(self, x_range, y_range):
+        """
+            Returns the indices, in the input list, of the points that fall within the given x-range and y-range.
+
+            Returns:
+            - numpy.ndarray: An int32 array of point indices.
+        """
+        ranks = [ranks[start:stop] for ranks, start, stop in self._rank_slices(x_range, y_range)]
+
+        return self.y_order[concatenate(ranks)] if ranks else self.y_order[:0]
+
+
+    def range_search(self, x_range, y_range):
+        """
+            Performs a range search, returning all points that fall within the given x-range and y-range.
+
+            Parameters:
+            - x_range (Tuple[int, int]): A tuple representing the x-range of the query, in the form (x_min, x_max).
+            - y_range (Tuple[int, int]): A tuple representing the y-range of the query, in the form (y_min, y_max).
+
+            Returns:
+            - List[Tuple[int, int]]: A list of the points in the tree that fall within the given x-range and y-range.
+        """
+        return [self.points[i] for i in self.range_indices(x_range, y_range)]
+
+
+    def range_count(self, x_range, y_range):
+        """ Counts the points that fall within the given x-range and y-range in O(log^2 n), without materializing them. """
+        return int(sum(stop - start for _, start, stop in self._rank_slices(x_range, y_range)))
+
+
+    def memory_usage(self):
+        """
+            Reports the memory held by the tree, in bytes, with the same keys as RangeTree2D.memory_usage,
+            so the two layouts can be compared directly. Points themselves are shared with the caller and are not counted.
+
+            Returns:
+            - dict: 'objects' for the Python objects of the tree, 'arrays' for the data of the NumPy arrays, and their 'total'.
+        """
+        arrays = [self.xs, self.ys, self.x_order, self.y_order] + self.levels
+
+        objects = getsizeof(self) + getsizeof(vars(self)) + getsizeof(self.points) + getsizeof(self.levels) + \
+                  sum(getsizeof(arr) - arr.nbytes for arr in arrays)
+
+        data = sum(arr.nbytes for arr in arrays)
+
+        return {'objects': objects, 'arrays': data, 'total': objects + data}
+
+
+
+class DynamicRangeTree2D:
+    """
+        A semi-dynamic 2D range tree that supports insertions, built with the logarithmic method.
+        New points are appended to a write buffer that queries scan linearly. When the buffer reaches buffer_size points,
+        it is turned into a static CompactRangeTree2D, merging with (and rebuilding) every existing static tree that is
+        not larger than it. Tree sizes thus grow geometrically, there are O(log n) of them, and every point is rebuilt
+        O(log n) times. A static tree of m points builds in O(m log m), merging the levels bottom-up, so every rebuild
+        costs O(log n) per point, for an amortized insertion cost of O(log^2 n).
+    """
+
+    def __init__(self, points=None, buffer_size=64, axes=(0, 1)):
+        """
+            Initializes the dynamic range tree, building a single static tree over the initial points.
+
+            Parameters:
+            - points (List[Tuple[int, int]]): An optional list of initial points.
+            - buffer_size (int): The number of buffered points that triggers a merge into the static trees (default: 64).
+            - axes (Tuple[int, int]): The point indices used as the x and y dimension (default: (0, 1)).
+        """
+        self.buffer_size = buffer_size
+        self.axes = tuple(axes)
+        self.buffer = []
+
+        # static trees, in decreasing order of size
+        self.trees = [CompactRangeTree2D(points, axes=self.axes)] if points else []
+
+
+    def __len__(self):
+        return len(self.buffer) + sum(len(tree) for tree in self.trees)
+
+
+    def insert(self, point):
+        """ Inserts a point, flushing the buffer into the static trees once it is full. """
+        self.buffer.append(point)
+
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+
+    def flush(self):
+        """
+            Merges the buffer with the trailing static trees that are not larger than it,
+            and rebuilds them as a single static tree.
+        """
+        if not self.buffer: return
+
+        points, self.buffer = self.buffer, []
+
+        while self.trees and len(self.trees[-1]) <= len(points):
+            points += self.trees.pop().points
+
+        self.trees.append(CompactRangeTree2D(points, axes=self.axes))
+
+
+    def _buffered(self, x_range, y_range):
+        x_axis, y_axis = self.axes
+        return [point for point in self.buffer
+                if x_range[0] <= point[x_axis] <= x_range[1] and y_range[0] <= point[y_axis] <= y_range[1]]
+
+
+    def range_search(self, x_range, y_range):
+        """
+            Performs a range search over the static trees and the buffer, returning all points that fall within
+            the given x-range and y-range.
+
+            Parameters:
+            - x_range (Tuple[int, int]): A tuple representing the x-range of the query, in the form (x_min, x_max).
+            - y_range (Tuple[int, int]): A tuple representing the y-range of the query, in the form (y_min, y_max).
+
+            Returns:
+            - List[Tuple[int, int]]: A list of the points that fall within the given x-range and y-range.
+        """
+        values = self._buffered(x_range, y_range)
+
+        for tree in self.trees:
+            values += tree.range_search(x_range, y_range)
+
+        return values
+
+
+    def range_count(self, x_range, y_range):
+        """ Counts the points that fall within the given x-range and y-range, without materializing those of the static trees. """
+        return len(self._buffered(x_range, y_range)) + sum(tree.range_count(x_range, y_range) for tree in self.trees)
+
+
+
+class RangeTreeND:
+    """
+        A d-dimensional range tree. The primary tree is a balanced binary tree over the points sorted by the first axis,
+        with the points stored on the leaves. Every internal node holds, as its associated structure, a RangeTreeND over
+        the remaining axes built on the points of its subtree. The recursion bottoms out on the compact sorted-array
+        form (ArrayRangeTree1D) for one axis and on the fractional cascading form (LayeredRangeTree2D) for two axes.
+    """
+
+    def __init__(self, points, dims):
+        """
+            Initializes a d-dimensional range tree with the given list of points.
+
+            Parameters:
+            - points (List[Tuple]): A list of points indexable by every axis.
+            - dims (int or Tuple[int]): The number of dimensions k, which indexes the axes 0..k-1 like KDTree,
+              or an explicit tuple of the point indices to use as axes.
+        """
+        self.axes = tuple(range(dims)) if isinstance(dims, int) else tuple(dims)
+
+        if not self.axes:
+            raise ValueError("RangeTreeND needs at least one dimension")
+
+        self.tree = None
+        self.root = None
+
+        if len(self.axes) == 1:
+            self.tree = ArrayRangeTree1D(points, axis=self.axes[0])
+
+        elif len(self.axes) == 2:
+            self.tree = LayeredRangeTree2D(points, axes=self.axes)
+
+        elif points:
+            # sort by the first axis, the input list is left untouched
+            points = sorted(points, key=lambda point: point[self.axes[0]])
+            self.root = self._build_tree(points, 0, len(points))
+
+
+    def _build_tree(self, points, lo, hi):
+        """
+            Builds the primary tree over the sorted points[lo:hi]. Leaves hold a single point, internal nodes hold the
+            last point of their left subtree as the split value, and an associated RangeTreeND over the remaining axes.
+
+            Returns:
+            - Node: The root node of the subtree.
+        """
+        if hi - lo == 1:
+            return Node(value=points[lo])
+
+        median = (lo + hi) // 2
+
+        left = self._build_tree(points, lo, median)
+        right = self._build_tree(points, median, hi)
+
+        return Node(left=left, right=right, value=points[median-1], y_tree=RangeTreeND(points[lo:hi], self.axes[1:]))
+
+
+    def _contains(self, point, query):
+        return all(low <= point[axis] <= high for axis, (low, high) in zip(self.axes, query))
+
+
+    def _report(self, node, query, values):
+        """ Appends the points of a canonical subtree that fall within the remaining dimensions of the query. """
+        if node.left is None:
+            if self._contains(node.value, query):
+                values.append(node.value)
+        else:
+            values += node.y_tree.range_search(query[1:])
+
+
+    def range_search(self, query):
+        """
+            Performs a range search, returning all points that fall within the query box.
+            The range on the first axis is decomposed into O(log n) canonical subtrees, whose associated structures
+            are searched recursively on the remaining axes.
+
+            Parameters:
+            - query (List[Tuple[int, int]]): One (min, max) range per axis, in the order of the axes.
+
+            Returns:
+            - List[Tuple]: A list of the points in the tree that fall within the query.
+        """
+        if len(query) != len(self.axes):
+            raise ValueError(f"Expected {len(self.axes)} ranges, got {len(query)}")
+
+        if len(self.axes) == 1:
+            return self.tree.query(query[0])
+
+        if len(self.axes) == 2:
+            return self.tree.range_search(query[0], query[1])
+
+        if self.root is None: return []
+
+        axis = self.axes[0]
+        values = []
+
+        for node, inside in _split_paths(self.root, query[0][0], query[0][1], key=lambda node: node.value[axis],
+                                         left=lambda node: node.left, right=lambda node: node.right):
+            if inside or node.left is None:
+                self._report(node, query, values)
+
+        return values
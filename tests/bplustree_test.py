@@ -0,0 +1,112 @@
+from os.path import dirname, abspath
+from sys import path
+
+# Get the path to the project root directory
+root_dir = dirname(dirname(abspath(__file__)))
+# Add the root directory to the system path
+path.append(root_dir)
+
+
+from mdds.trees import BPlusTree
+
+from random import Random
+
+
+def brute_force(points, range, axis=0):
+    # the points with key within range, ordered by key as the tree reports them
+    return sorted((point for point in points if range[0] <= point[axis] <= range[1]), key=lambda point: point[axis])
+
+
+def check_queries(tree, points, random, queries=200):
+    for _ in range(queries):
+        low, high = sorted(random.randint(-5, 105) for _ in range(2))
+
+        results = tree.query((low, high))
+
+        # same points, and ordered by key
+        assert sorted(results) == sorted(brute_force(points, (low, high))), (low, high)
+        assert [point[0] for point in results] == sorted(point[0] for point in results)
+
+
+if __name__ == "__main__":
+
+    random = Random(0)
+
+    ######################## Sorted inserts #############################
+
+    # increasing keys always split the rightmost leaf, the tree must stay balanced
+    points = [(i, i) for i in range(1000)]
+    tree = BPlusTree(points, order=4)
+
+    assert len(tree) == len(points)
+    assert tree.query((0, 999)) == points
+    assert tree.query((250, 259)) == points[250:260]
+
+    # decreasing keys
+    tree = BPlusTree(points[::-1], order=4)
+    assert tree.query((0, 999)) == points
+
+    print(f"Sorted inserts: {len(tree)} points")
+
+    ######################## Duplicate keys #############################
+
+    # few distinct keys, so that equal keys span several leaves
+    points = [(random.randint(0, 100) // 10 * 10, i) for i in range(2000)]
+    tree = BPlusTree(points, order=5)
+
+    check_queries(tree, points, random)
+
+    # delete every other point with a duplicate key
+    random.shuffle(points)
+    deleted, points = points[::2], points[1::2]
+
+    for point in deleted:
+        assert tree.delete(point)
+
+    # a point that is not in the tree any more
+    assert not tree.delete(deleted[0])
+    assert len(tree) == len(points)
+
+    check_queries(tree, points, random)
+
+    # update half of the remaining points, moving them to another key
+    updated = []
+    for i, point in enumerate(points):
+        if i % 2:
+            new_point = (random.randint(0, 100), point[1])
+            tree.update(point, new_point)
+            point = new_point
+        updated.append(point)
+    points = updated
+
+    assert len(tree) == len(points)
+    check_queries(tree, points, random)
+
+    print(f"Duplicate keys: {len(tree)} points after deletes and updates")
+
+    ######################## Random operations ##########################
+
+    # interleaved inserts and deletes, checked against a list
+    tree, points = BPlusTree(order=3), []
+
+    for i in range(5000):
+        if points and random.random() < .4:
+            point = points.pop(random.randrange(len(points)))
+            assert tree.delete(point)
+        else:
+            point = (random.randint(0, 100), i)
+            tree.insert(point)
+            points.append(point)
+
+    assert len(tree) == len(points)
+    check_queries(tree, points, random)
+
+    # delete everything, the tree shrinks back to an empty leaf
+    for point in points:
+        assert tree.delete(point)
+
+    assert len(tree) == 0
+    assert tree.root.leaf
+    assert tree.query((0, 100)) == []
+
+    print("Random operations: all queries match the brute force")
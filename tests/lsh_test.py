@@ -7,11 +7,36 @@ root_dir = dirname(dirname(abspath(__file__)))
 path.append(root_dir)
 
 from mdds.helpers import *
-from mdds.neighbors import LSH
+from mdds.neighbors import LSH, LSHForest, BBitMinHash, OnePermutationHash, WeightedMinHash, SimHash, PStableHash
 
-from numpy import stack
+from numpy import arange, array, concatenate, int64
 from numpy.random import choice
 from pandas import read_csv
+from tempfile import TemporaryDirectory
+from collections import Counter
+
+
+def brute_force(documents, doc):
+    # exact jaccard similarity of doc to every document
+    return [len(doc & other) / len(doc | other) if doc | other else 0. for other in documents]
+
+
+def check_family(family, documents, similar, tolerance=.1):
+    # fit and verify the neighbors in the metric of the family, then compare the estimates of the signatures
+    # with the exact similarity, on the pairs found and the pairs of consecutive documents
+    model = LSH(nfuncs=256, bands=64, hash_family=family, seed=1).fit(data=documents)
+    found = model.neighbors(similar=similar)
+
+    pairs = array(sorted(found), dtype=int64).reshape(-1, 2)
+    i = concatenate((arange(len(documents) - 1), pairs[:, 0]))
+    j = concatenate((arange(1, len(documents)), pairs[:, 1]))
+
+    exact = model.hash_mehod.columns.similarity(i, j, metric=model.hash_mehod.metric)
+    error = abs(model.hash_mehod.estimate(i, j) - exact).mean()
+    assert error < tolerance, (family.__name__, error)
+
+    print(f"{family.__name__}: {len(found)} pairs with {model.hash_mehod.metric} similarity >= {similar}, "
+          f"mean estimate error {error:.3f}")
 
 
 if __name__ == "__main__":
@@ -25,26 +50,146 @@ if __name__ == "__main__":
     # shingle size step
     k = 2
 
-    # create vocabulary with shingles        
-    vocabulary = set().union(*[kshingle(sent, k) for sent in data])
+    # create vocabulary with shingles, in a fixed order
+    vocabulary = list(set().union(*[kshingle(sent, k) for sent in data]))
     
-    # one hot representation of each document
-    one_hot_matrix = stack([one_hot_encoding(vocabulary, sent) for sent in data]).T
+    # sparse one hot representation of each document, the ids of its shingles
+    documents = [one_hot_indices(vocabulary, sent) for sent in data]
 
     # create LSH model providing the bands magnitute 
     # in fit hashes each column for each band of the sign matrix M to a hash table with k buckets
-    lsh = LSH(nfuncs=50, bands=5).fit(data=one_hot_matrix, num_buckets=1000)
+    lsh = LSH(nfuncs=50, bands=5).fit(data=documents, num_buckets=1000)
 
     # get neigbors with similarity bigger than 65%
     print("All point pairs in space with similarity >= 65%")
     actual_neigbors = lsh.neighbors(similar=0.65, dist_func=cosine_similarity)
     print(actual_neigbors, end='\n\n')
 
+    # every pair is reported once, smaller id first
+    assert all(c1 < c2 for c1, c2 in actual_neigbors)
+
+    # the vectorized verification reports every pair once as well
+    i, j, sims = lsh.batch_neighbors(similar=0.65, metric='cosine')
+    assert (i < j).all() and len(set(zip(i.tolist(), j.tolist()))) == len(i)
+
+    # estimated from the signatures, ordered by decreasing estimate, every pair once
+    estimated = lsh.neighbors(similar=0.65, estimate=True)
+    assert all(c1 < c2 for c1, c2 in estimated)
+    assert list(estimated.values()) == sorted(estimated.values(), reverse=True)
+
+    ids, estimates = lsh.top_k(0, k=5)
+    assert 0 not in ids and len(set(ids.tolist())) == len(ids)
+
     q_vec = choice(2, len(vocabulary))
     
-    r=0.1 # radius to search
-    nearest_neigbors = lsh.get_nearest_neighbors(query=q_vec, radius=r)
-    print(f"All point pairs withing radius {r} of query")
+    p=2 # nearby buckets to probe per band
+    nearest_neigbors = lsh.get_nearest_neighbors(query=q_vec, probes=p)
+    print(f"All points in the query buckets and the {p} closest buckets per band")
     
     print(nearest_neigbors)
 
+    ######################## Multi-probe queries ######################
+
+    # probing nearby buckets only adds candidates, so the recall of few bands can only grow with probes
+    few_bands = LSH(nfuncs=20, bands=5, seed=1).fit(data=documents)
+    many_bands = LSH(nfuncs=80, bands=20, seed=1).fit(data=documents)
+
+    threshold = .5
+    queries = documents[:50]
+    true_ids = [{i for i, sim in enumerate(brute_force(documents, doc)) if sim >= threshold} for doc in queries]
+
+    def recall(model, probes):
+        found = [set(model.query(doc, threshold=threshold, metric='jaccard', probes=probes)) for doc in queries]
+        return sum(len(f & t) for f, t in zip(found, true_ids)) / sum(len(t) for t in true_ids)
+
+    recalls = [recall(few_bands, probes) for probes in (0, 5, 20)]
+    assert recalls == sorted(recalls)
+
+    print(f"Recall at {threshold}: 5 bands with 0, 5, 20 probes {recalls}, 20 bands {recall(many_bands, 0)}")
+
+    ######################## Cosine and euclidean families #############
+
+    check_family(SimHash, documents, similar=.65)
+    check_family(PStableHash, documents, similar=.3)
+
+    ######################## b-bit MinHash ############################
+
+    # the packed signatures expand back to the b-bit values, and estimate from them as from the unpacked ones
+    bbit = BBitMinHash(documents, nfuncs=64, seed=1, bits=2)
+    signatures = bbit._signature_matrix()
+    assert (bbit.expand(bbit.sign_matrix) == signatures).all()
+
+    i, j = arange(len(documents) - 1), arange(1, len(documents))
+    chance = 2. ** -bbit.bits
+    unpacked = ((signatures[:, i] == signatures[:, j]).mean(axis=0) - chance) / (1 - chance)
+    assert (abs(bbit.estimate(i, j) - unpacked) < 1e-12).all()
+
+    print(f"b-bit MinHash: {bbit.sign_matrix.nbytes} bytes of packed signatures for {len(documents)} documents")
+
+    check_family(BBitMinHash, documents, similar=.5)
+
+    ######################## One permutation hashing ###################
+
+    # one hash per shingle instead of one per shingle and function, same estimates as MinHash
+    check_family(OnePermutationHash, documents, similar=.5)
+
+    ######################## Weighted MinHash #########################
+
+    # the number of occurrences of every shingle in its document as weight
+    weighted_documents = [Counter({i: sent.count(vocabulary[i]) for i in doc}) for doc, sent in zip(documents, data)]
+
+    check_family(WeightedMinHash, weighted_documents, similar=.5)
+
+    ######################## Save and load ##############################
+
+    with TemporaryDirectory() as index_dir:
+        lsh.save(index_dir)
+        loaded = LSH.load(index_dir)
+
+        # same buckets, same verified pairs
+        assert loaded.neighbors(similar=0.65) == lsh.neighbors(similar=0.65)
+        assert loaded.get_nearest_neighbors(query=q_vec, probes=p) == nearest_neigbors
+
+        del loaded
+
+    print("Save and load: the loaded model finds the same neighbors")
+
+    ######################## Out of core fit ############################
+
+    # the documents read by chunks of 100, as they would be from a large file
+    chunks = (documents[i:i + 100] for i in range(0, len(documents), 100))
+
+    with TemporaryDirectory() as index_dir:
+        streamed = LSH(nfuncs=50, bands=5, seed=1).fit_stream(chunks, index_dir, num_buckets=1000)
+        fitted = LSH(nfuncs=50, bands=5, seed=1).fit(data=documents, num_buckets=1000)
+
+        # the same hash functions put every document in the same buckets
+        assert (streamed.hash_mehod.sign_matrix == fitted.hash_mehod.sign_matrix).all()
+        assert streamed.neighbors(similar=0.65) == fitted.neighbors(similar=0.65)
+
+        del streamed
+
+    print("Out of core fit: same signatures and neighbors as fit")
+
+    ######################## LSH Forest #################################
+
+    forest = LSHForest(nfuncs=64, trees=8, seed=1).fit(documents)
+
+    doc = documents[0]
+    exact = brute_force(documents, doc)
+
+    # top k, the similarities are exact and sorted
+    ids, sims = forest.top_k(doc, k=5)
+    assert all(abs(sim - exact[i]) < 1e-9 for i, sim in zip(ids, sims))
+    assert list(sims) == sorted(sims, reverse=True)
+
+    best = sorted(range(len(documents)), key=lambda i: -exact[i])[:5]
+    print(f"LSH Forest top 5 of document 0: {ids.tolist()}, brute force: {best}")
+
+    # query, no false positives, and the recall at the threshold
+    threshold = .5
+    found = forest.query(doc, threshold=threshold)
+    assert all(exact[i] >= threshold and abs(sim - exact[i]) < 1e-9 for i, sim in found.items())
+
+    true_ids = {i for i, sim in enumerate(exact) if sim >= threshold}
+    print(f"LSH Forest query of document 0: {len(found)} of the {len(true_ids)} documents with similarity >= {threshold}")
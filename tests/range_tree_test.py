@@ -7,12 +7,23 @@ root_dir = dirname(dirname(abspath(__file__)))
 path.append(root_dir)
 
 
-from mdds.trees import RangeTree2D
+from mdds.trees import RangeTree2D, LayeredRangeTree2D, CompactRangeTree2D, DynamicRangeTree2D, RangeTreeND
 from mdds.geometry import Point
 from mdds.helpers import *
 
 from pandas import read_csv
 from numpy import stack
+from random import Random
+
+
+def brute_force(points, box, axes=(0, 1)):
+    # the points within every (min, max) range of box, on the given axes
+    return [point for point in points if all(low <= point[axis] <= high for axis, (low, high) in zip(axes, box))]
+
+
+def random_boxes(random, count, dims, low=-5, high=55):
+    # query boxes with bounds inside and around the coordinates of the points
+    return [[tuple(sorted(random.randint(low, high) for _ in range(2))) for _ in range(dims)] for _ in range(count)]
 
 
 if __name__ == "__main__":
@@ -62,3 +73,82 @@ if __name__ == "__main__":
     results = range_tree.range_search(x_range, y_range)
     print(f"{len(results)} search results:")
     print(results)
+
+    ######################## Layered Range Tree #########################
+
+    # Create and build tree with fractional cascading
+    layered_tree = LayeredRangeTree2D(points)
+
+    # make query, must retrieve the same points
+    layered_results = layered_tree.range_search(x_range, y_range)
+    print(f"{len(layered_results)} layered search results:")
+    print(layered_results)
+
+    ######################## Range count and sum ########################
+
+    # random points with many duplicate coordinates, and a weight
+    random = Random(0)
+    grid = [(random.randint(0, 50), random.randint(0, 50), random.randint(1, 9)) for _ in range(2000)]
+
+    grid_tree = RangeTree2D(grid)
+
+    for x_range, y_range in random_boxes(random, 200, 2):
+        inside = brute_force(grid, (x_range, y_range))
+
+        assert sorted(grid_tree.range_search(x_range, y_range)) == sorted(inside)
+        assert grid_tree.range_count(x_range, y_range) == len(inside)
+        assert grid_tree.range_sum(x_range, y_range, 2) == sum(point[2] for point in inside)
+
+    print("Range count and sum: all queries match the brute force")
+
+    ######################## d-dimensional Range Tree ###################
+
+    for dims in (1, 2, 3):
+        nd_tree = RangeTreeND(grid, dims)
+
+        for box in random_boxes(random, 100, dims):
+            assert sorted(nd_tree.range_search(box)) == sorted(brute_force(grid, box, axes=range(dims)))
+
+    # explicit axes, in another order
+    nd_tree = RangeTreeND(grid, (2, 0, 1))
+    for box in random_boxes(random, 100, 3):
+        assert sorted(nd_tree.range_search(box)) == sorted(brute_force(grid, box, axes=(2, 0, 1)))
+
+    print("d-dimensional Range Tree: all queries match the brute force")
+
+    ######################## Compact Range Tree #########################
+
+    compact_tree = CompactRangeTree2D(grid)
+
+    for x_range, y_range in random_boxes(random, 200, 2):
+        inside = brute_force(grid, (x_range, y_range))
+
+        assert sorted(compact_tree.range_search(x_range, y_range)) == sorted(inside)
+        assert compact_tree.range_count(x_range, y_range) == len(inside)
+        assert sorted(grid[i] for i in compact_tree.range_indices(x_range, y_range)) == sorted(inside)
+
+    # the same points, a fraction of the memory
+    print(f"Compact Range Tree: {compact_tree.memory_usage()['total']} bytes, against {grid_tree.memory_usage()['total']} bytes")
+
+    ######################## Dynamic Range Tree #########################
+
+    # half of the points up front, the rest inserted one by one through a small buffer
+    dynamic_tree = DynamicRangeTree2D(grid[:1000], buffer_size=16)
+
+    for n, point in enumerate(grid[1000:], start=1001):
+        dynamic_tree.insert(point)
+
+        # check while points are both buffered and in static trees of several sizes
+        if n % 250 == 0:
+            assert len(dynamic_tree) == n
+
+            for x_range, y_range in random_boxes(random, 20, 2):
+                inside = brute_force(grid[:n], (x_range, y_range))
+
+                assert sorted(dynamic_tree.range_search(x_range, y_range)) == sorted(inside)
+                assert dynamic_tree.range_count(x_range, y_range) == len(inside)
+
+    dynamic_tree.flush()
+    assert not dynamic_tree.buffer and len(dynamic_tree) == len(grid)
+
+    print(f"Dynamic Range Tree: {len(dynamic_tree.trees)} static trees, all queries match the brute force")